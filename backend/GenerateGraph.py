@@ -1,42 +1,39 @@
-import json
 import os
+import sys
+import glob
 import random
-import matplotlib.pyplot as plt
-import seaborn as sns
+from xml.sax.saxutils import escape
 from google import genai
-import pandas as pd
-# Set up Google API client
-API_KEY = os.environ.get("GOOGLE_GRAPH_API_KEY")  # Fetch from environment variables
-client = genai.Client(api_key=API_KEY)
-
-# Load SQL results from file
-with open("sql_results.json", "r") as file:
-    sql_results = json.load(file)
-
-# Ensure charts folder exists
-os.makedirs("charts", exist_ok=True)
-
-# Prepare a sample (max 12 rows per query) for the API prompt
-query_samples = []
-for result in sql_results:
-    query = result["query"]
-    rows = result["rows"]
-    sample_rows = random.sample(rows, min(12, len(rows)))
-    query_samples.append({"query": query, "sample": sample_rows})
-
-# Construct the prompt with all queries and their sample data in one go
-prompt = """Write a Python script to visualize the following SQL query results:
+import llm_cache
+from result_store import load_results, iter_rows, reservoir_sample
+from chart_renderer import render_charts
+from instrumentation import request, span, count
+# PDF Report Generator:
+from reportlab.lib.pagesizes import letter
+from reportlab.platypus import SimpleDocTemplate, Image, Paragraph, Spacer, PageBreak
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from PIL import Image as PILImage
 
-"""
-for qs in query_samples:
-    prompt += f"Query: {qs['query']}\nSample Data: {qs['sample']}\n\n"
+MODEL_NAME = "gemini-2.0-flash-thinking-exp-01-21"
+# Bump when the chart or description prompt changes so old cached responses are not reused
+PROMPT_VERSION = 2
+# Per-chart limits for the rendering workers
+CHART_TIMEOUT = float(os.environ.get("CHART_TIMEOUT", "60"))
+CHART_MEMORY_LIMIT_MB = int(os.environ.get("CHART_MEMORY_LIMIT_MB", "2048"))
+# Alternative Gemini endpoint, e.g. the local stub used by bench_pipeline.py
+GEMINI_BASE_URL = os.environ.get("GEMINI_BASE_URL")
+CHART_WORKERS = int(os.environ["CHART_WORKERS"]) if os.environ.get("CHART_WORKERS") else None
+# Downsample large results before plotting (see downsample.py); CHART_REDUCE=0 plots every row
+CHART_REDUCE = os.environ.get("CHART_REDUCE", "1").lower() not in ("0", "false", "no")
 
-prompt += """For each query, generate an appropriate graph using matplotlib or seaborn and save it as a PNG file in the 'charts' folder that is in the same directory.
+CHART_INSTRUCTIONS = """For each query, generate an appropriate graph using matplotlib or seaborn and save it as a PNG file in the 'charts' folder that is in the same directory.
 Assume matplotlib and seaborn are already imported, and do not include any import statements.
 Return only valid Python code without explanations, comments, or markdown formatting. Be creative in your graphs.
 You must diversify the amount of graphs whenever appropriate. Use different kind of bar charts, pie charts, pairplots, lineplots, histograms,
 scatter plots, box plots, heatmaps wherever appropriate but ensure you use different kind of charts and not just bar plots.
 The function name must be "visualize_query(query_index, query_data, description="")"
+query_data is a pandas DataFrame holding the result of the query, with the same column names as the sample data. pandas is available as pd.
+Very large results are downsampled before they reach visualize_query (keeping their shape), and categories beyond the top 20 may be grouped as "Other".
 Ensure all the column names are proper. Make your plots colorful. Add Legends. We have limited those results containing a lot of rows to maximum 12 rows.
 Hence, ensure your code for such queries fit the entire dataset and not just the 12 rows displayed to you. However, everything else you can display properly as is. 
 Ensure the titles are appropriate and customised well for the query. 
@@ -48,143 +45,212 @@ If the query involves dates, years, or time-based data, convert them into a **nu
 If the x-axis contains years or dates, **convert them to integers or datetime format** to avoid string-based errors.
 """
 
-# Send the prompt in a single API call to generate the visualization code
-response = client.models.generate_content(
-    model="gemini-2.0-flash-thinking-exp-01-21", contents=prompt
-)
-
-descriptionprompt = """For the following queries with their results (limited to max 12 if there are a lot of rows per query):\n"""
-
-for i, qs in enumerate(query_samples, start=1):
-    descriptionprompt += f"Query {i}: {qs['query']}\nSample Data: {qs['sample']}\n\n"
-
-descriptionprompt += """Generate an analytical description (about 2 sentences) for each query and its results.
+DESCRIPTION_INSTRUCTIONS = """Generate an analytical description (about 2 sentences) for each query and its results.
 Return it in the format: 'queryi:descriptioni' where i is the serial number of each query starting from 1.
 Do note, that results with a lot of rows are limited to maximum of 12 so ensure you do not consider only those results displayed
 to you, in such queries only.
 """
 
-descriptionresponse = client.models.generate_content(
-    model='gemini-2.0-flash-thinking-exp-01-21', contents=descriptionprompt
-).text
-
-generated_code = response.text
-
-# Remove markdown formatting if present
-if generated_code.startswith("```python"):
-    generated_code = generated_code[9:]
-if generated_code.endswith("```"):
-    generated_code = generated_code[:-3]
-
-print("Generated Code:\n", generated_code)  # Debugging step
-
-# Prepare the full dataset for execution; store the original list-of-dictionaries.
-exec_env = {"os": os, "plt": plt, "sns": sns, "data_sets": {}}
-for result in sql_results:
-    query = result["query"]
-    rows = result["rows"]
-    exec_env["data_sets"][query] = rows  # Use the original list-of-dictionaries
-
-# Execute the generated code. This code should define a function 'visualize_query'
-exec(generated_code, exec_env)
-
-# Call the visualization function on each full dataset.
-if "visualize_query" in exec_env:
-    for i, (query_text, full_data) in enumerate(exec_env["data_sets"].items(), start=1):
-        query_filename = f"charts/query{i}.png"  # Ensure it's query1.png, query2.png, etc.
-        try:
-            # Pass the filename to the visualize_query function
-            exec_env["visualize_query"](i, full_data, description=query_filename)
-            print(f"Graph for query '{query_text}' saved as {query_filename}")
-        except Exception as e:
-            print(f"Error generating graph for query '{query_text}': {e}")
-else:
-    print("No visualization function found in generated code.")
-
-print("Graphs saved in charts folder.")
-print("Descriptions: ", descriptionresponse)
-#-----------------------------------------------------------------------------------------------
+def build_query_samples(sql_results):
+    # Prepare a sample (max 12 rows per query) for the API prompt, in one pass over each result
+    query_samples = []
+    for result in sql_results:
+        query = result["query"]
+        # Seeded by the query so identical results give identical prompts (and LLM cache hits)
+        sample_rows = reservoir_sample(iter_rows(result), 12, random.Random(query))
+        query_samples.append({"query": query, "sample": sample_rows})
+    return query_samples
 
-# PDF Report Generator:
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Image, Paragraph, Spacer, PageBreak
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from PIL import Image as PILImage
-import os
+def build_chart_prompt(query_samples):
+    # Construct the prompt with all queries and their sample data in one go
+    prompt = """Write a Python script to visualize the following SQL query results:
+
+"""
+    for qs in query_samples:
+        prompt += f"Query: {qs['query']}\nSample Data: {qs['sample']}\n\n"
+    return prompt + CHART_INSTRUCTIONS
+
+def build_description_prompt(query_samples):
+    descriptionprompt = """For the following queries with their results (limited to max 12 if there are a lot of rows per query):\n"""
+    for i, qs in enumerate(query_samples, start=1):
+        descriptionprompt += f"Query {i}: {qs['query']}\nSample Data: {qs['sample']}\n\n"
+    return descriptionprompt + DESCRIPTION_INSTRUCTIONS
+
+def strip_code_fences(generated_code):
+    # Remove markdown formatting if present
+    if generated_code.startswith("```python"):
+        generated_code = generated_code[9:]
+    if generated_code.endswith("```"):
+        generated_code = generated_code[:-3]
+    return generated_code
+
+def generate(client, namespace, prompt):
+    # Returns (text, store). The prompt already contains every query and its sample rows, so its
+    # exact text is the cache key; store() caches a fresh response once the caller trusts it.
+    with span(f"llm.{namespace}", prompt_chars=len(prompt)):
+        hit, text = llm_cache.get(namespace, prompt, None, MODEL_NAME, PROMPT_VERSION, normalize=False)
+        if hit:
+            return text, lambda: None
+        # Only counted on a cache miss, so the span's llm.requests counter tells hits from misses
+        count("llm.requests")
+        text = client.models.generate_content(model=MODEL_NAME, contents=prompt).text
+    return text, lambda: llm_cache.put(namespace, prompt, None, MODEL_NAME, PROMPT_VERSION, text, normalize=False)
+
+def generate_cached(client, namespace, prompt):
+    text, store = generate(client, namespace, prompt)
+    store()
+    return text
+
+def render_all_charts(generated_code, sql_results):
+    # Each chart renders in its own worker process; results are reported as they finish,
+    # the PDF later picks the files up in query order
+    for stale_chart in glob.glob("charts/query*.png"):
+        os.remove(stale_chart)
+
+    # A query that failed has no rows to draw, so it gets no chart and can't fail the chart code
+    jobs = []
+    for i, result in enumerate(sql_results, start=1):
+        if "error" in result:
+            print(f"No graph for query '{result['query']}': {result['error']}")
+        else:
+            jobs.append((i, result, f"charts/query{i}.png"))
+
+    def report(index, outcome):
+        query_text = sql_results[index - 1]["query"]
+        if outcome["error"]:
+            print(f"Error generating graph for query '{query_text}': {outcome['error']}")
+        else:
+            print(f"Graph for query '{query_text}' saved as {outcome['filename']} ({outcome['seconds']:.2f}s)")
+            if outcome["reduction"]:
+                print(f"  Data reduced for plotting: {outcome['reduction']}")
+
+    return render_charts(generated_code, jobs, workers=CHART_WORKERS, chart_timeout=CHART_TIMEOUT,
+                         memory_limit_mb=CHART_MEMORY_LIMIT_MB, on_result=report, reduce_data=CHART_REDUCE)
+
+def build_pdf(query_samples, descriptionresponse, reductions=None):
+    # reductions: {query index: note} for charts drawn from downsampled data
+    # Parse descriptions from the description response
+    description_lines = descriptionresponse.strip().split("\n")
+    descriptions = {}
+    for line in description_lines:
+        if line.startswith("query"):
+            query_id, description = line.split(":", 1)
+            descriptions[query_id.strip()] = description.strip()
+
+    # Extract SQL queries from query_samples
+    sql_queries = {f"query{i+1}": qs["query"] for i, qs in enumerate(query_samples)}
+
+    # Create PDF document
+    pdf_filename = "query_report.pdf"
+    doc = SimpleDocTemplate(
+        pdf_filename,
+        pagesize=letter,
+        title="RazorX Generated Report",
+        author="RazorX",
+        subject="SQL Query Visualizations",
+    )
+
+    # Define styles
+    styles = getSampleStyleSheet()
+    sql_style = ParagraphStyle(
+        name="SQLStyle",
+        fontName="Courier",
+        fontSize=10,
+        leading=12,
+        spaceAfter=10,
+    )
+    content = []
+
+    # Add Title to PDF
+    title = Paragraph("<b><font size=16>RazorX Generated Report</font></b>", styles["Title"])
+    content.append(title)
+    content.append(Spacer(1, 20))  # Space below the title
+
+    # Iterate over queries and add SQL query, images, and descriptions to PDF
+    for i in range(1, len(query_samples) + 1):  # Ensure we match the query numbering
+        query_filename = f"charts/query{i}.png"
+
+        # Add SQL query as a heading
+        sql_query_text = sql_queries.get(f"query{i}", "SQL query not available.")
+        sql_query_paragraph = Paragraph(f"<b>Query {i}:</b><br/>{sql_query_text}", sql_style)
+        content.append(sql_query_paragraph)
+        content.append(Spacer(1, 10))  # Space between SQL query and image
+
+        # Add the image
+        if os.path.exists(query_filename):
+            pil_img = PILImage.open(query_filename)
+            img_width, img_height = pil_img.size
+            aspect_ratio = img_width / img_height
+            new_width = 400  # Set a fixed width
+            new_height = new_width / aspect_ratio
+            img = Image(query_filename, width=new_width, height=new_height)
+            content.append(img)
+        else:
+            missing_image_msg = Paragraph(f"<b>Image for Query {i} not found.</b>", styles["Normal"])
+            content.append(missing_image_msg)
+
+        # Add the query description
+        description_text = descriptions.get(f"query{i}", "<font color='red'>No description available.</font>")
+        reduction = (reductions or {}).get(i)
+        if reduction:
+            description_text += f"<br/><i>Chart data reduced for plotting: {escape(reduction)}.</i>"
+        paragraph = Paragraph(description_text, styles["Normal"])
+        content.append(paragraph)
+        content.append(Spacer(1, 20))  # Space between entries
+
+        # Add a page break after every query except the last one
+        if i != len(query_samples):
+            content.append(PageBreak())
+
+    # Build the PDF
+    try:
+        with span("pdf.build", pages=len(query_samples)):
+            doc.build(content)
+        print(f"PDF saved as {pdf_filename}")
+    except Exception as e:
+        print(f"Error generating PDF: {e}")
+
+def main():
+    # Set up Google API client
+    API_KEY = os.environ.get("GOOGLE_GRAPH_API_KEY")  # Fetch from environment variables
+    client = genai.Client(api_key=API_KEY, http_options={"base_url": GEMINI_BASE_URL} if GEMINI_BASE_URL else None)
+
+    # Load SQL results: the sql_results/ NDJSON manifest if present, else the legacy sql_results.json.
+    # Only the manifest is read here, rows are streamed from disk when needed.
+    with span("load_results"):
+        sql_results = load_results(sys.argv[1] if len(sys.argv) > 1 else None)
+    count("queries", len(sql_results))
+
+    # Ensure charts folder exists
+    os.makedirs("charts", exist_ok=True)
+
+    with span("sample_results"):
+        query_samples = build_query_samples(sql_results)
+
+    # Send the prompt in a single API call to generate the visualization code. It is only cached
+    # once it has rendered every chart, so broken code is regenerated on the next run.
+    response_text, store_chart_code = generate(client, "chart_code", build_chart_prompt(query_samples))
+
+    descriptionresponse = generate_cached(client, "chart_descriptions", build_description_prompt(query_samples))
+
+    generated_code = strip_code_fences(response_text)
+
+    print("Generated Code:\n", generated_code)  # Debugging step
+
+    # Execute the generated code once per worker and render every chart from its full dataset
+    with span("render_charts", charts=len(sql_results)):
+        chart_results = render_all_charts(generated_code, sql_results)
+    reductions = {index: outcome["reduction"] for index, outcome in chart_results.items() if outcome["reduction"]}
+    if chart_results and not any(outcome["error"] for outcome in chart_results.values()):
+        store_chart_code()
+
+    print("Graphs saved in charts folder.")
+    print("Descriptions: ", descriptionresponse)
+
+    with span("pdf"):
+        build_pdf(query_samples, descriptionresponse, reductions)
 
-# Parse descriptions from the description response
-description_lines = descriptionresponse.strip().split("\n")
-descriptions = {}
-for line in description_lines:
-    if line.startswith("query"):
-        query_id, description = line.split(":", 1)
-        descriptions[query_id.strip()] = description.strip()
-
-# Extract SQL queries from query_samples
-sql_queries = {f"query{i+1}": qs["query"] for i, qs in enumerate(query_samples)}
-
-# Create PDF document
-pdf_filename = "query_report.pdf"
-doc = SimpleDocTemplate(
-    pdf_filename,
-    pagesize=letter,
-    title="RazorX Generated Report",
-    author="RazorX",
-    subject="SQL Query Visualizations",
-)
-
-# Define styles
-styles = getSampleStyleSheet()
-sql_style = ParagraphStyle(
-    name="SQLStyle",
-    fontName="Courier",
-    fontSize=10,
-    leading=12,
-    spaceAfter=10,
-)
-content = []
-
-# Add Title to PDF
-title = Paragraph("<b><font size=16>RazorX Generated Report</font></b>", styles["Title"])
-content.append(title)
-content.append(Spacer(1, 20))  # Space below the title
-
-# Iterate over queries and add SQL query, images, and descriptions to PDF
-for i in range(1, len(query_samples) + 1):  # Ensure we match the query numbering
-    query_filename = f"charts/query{i}.png"
-    
-    # Add SQL query as a heading
-    sql_query_text = sql_queries.get(f"query{i}", "SQL query not available.")
-    sql_query_paragraph = Paragraph(f"<b>Query {i}:</b><br/>{sql_query_text}", sql_style)
-    content.append(sql_query_paragraph)
-    content.append(Spacer(1, 10))  # Space between SQL query and image
-
-    # Add the image
-    if os.path.exists(query_filename):
-        pil_img = PILImage.open(query_filename)
-        img_width, img_height = pil_img.size
-        aspect_ratio = img_width / img_height
-        new_width = 400  # Set a fixed width
-        new_height = new_width / aspect_ratio
-        img = Image(query_filename, width=new_width, height=new_height)
-        content.append(img)
-    else:
-        missing_image_msg = Paragraph(f"<b>Image for Query {i} not found.</b>", styles["Normal"])
-        content.append(missing_image_msg)
-    
-    # Add the query description
-    description_text = descriptions.get(f"query{i}", "<font color='red'>No description available.</font>")
-    paragraph = Paragraph(description_text, styles["Normal"])
-    content.append(paragraph)
-    content.append(Spacer(1, 20))  # Space between entries
-    
-    # Add a page break after every query except the last one
-    if i != len(query_samples):
-        content.append(PageBreak())
-
-# Build the PDF
-try:
-    doc.build(content)
-    print(f"PDF saved as {pdf_filename}")
-except Exception as e:
-    print(f"Error generating PDF: {e}")
\ No newline at end of file
+if __name__ == "__main__":
+    # One JSON trace per report when RAZORX_TRACE is set (see instrumentation.py)
+    with request("GenerateGraph"):
+        main()
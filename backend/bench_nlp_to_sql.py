@@ -0,0 +1,73 @@
+import time
+import argparse
+from nlp_to_sql import convert_texts_to_sql, encode_question, get_model, get_tokenizer
+from bench_pipeline import percentile
+
+QUESTIONS = [
+    "What are the total sales for the last quarter?",
+    "How many customers placed more than five orders?",
+    "List the top ten products by revenue",
+    "Which country had the highest profit in 2014?",
+    "Show the average discount per segment",
+    "How many orders were shipped late last month?",
+    "What is the monthly revenue trend for Paseo?",
+    "Which employees handled the most orders?",
+]
+
+# (name, quantize, num_beams, batch_size); the first row is the original one-at-a-time fp32 beam search
+CONFIGS = [
+    ("fp32 beam=5 batch=1", False, 5, 1),
+    ("fp32 beam=5 batched", False, 5, None),
+    ("fp32 greedy batched", False, 1, None),
+    ("int8 beam=5 batched", True, 5, None),
+    ("int8 greedy batched", True, 1, None),
+]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latency and throughput of the offline T5 NL-to-SQL model.")
+    parser.add_argument("--questions", type=int, default=32, help="Questions per run, cycled from a fixed list")
+    parser.add_argument("--batch-size", type=int, default=8, help="Batch size for the batched configurations")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed runs per configuration")
+    args = parser.parse_args()
+
+    questions = [QUESTIONS[i % len(QUESTIONS)] for i in range(args.questions)]
+
+    # Loading is excluded from the timings; it happens once per process in production
+    start = time.perf_counter()
+    get_tokenizer()
+    get_model(False)
+    print(f"fp32 model loaded in {time.perf_counter() - start:.2f}s")
+    start = time.perf_counter()
+    get_model(True)
+    print(f"int8 model loaded in {time.perf_counter() - start:.2f}s")
+
+    start = time.perf_counter()
+    encode_question.cache_clear()
+    for question in questions:
+        encode_question(question)
+    print(f"Tokenized {len(questions)} questions in {(time.perf_counter() - start) * 1000:.1f} ms "
+          f"({encode_question.cache_info().hits} served from the encoding cache)")
+
+    reference = None
+    # Latency is per question: the time until its answer is available, i.e. the duration of the
+    # batch it was submitted in. Percentiles are over every question of every repeat.
+    print(f"{'configuration':<22} {'p50 ms':>9} {'p95 ms':>9} {'q/s':>7} {'same as fp32 beam':>18}")
+    for name, quantize, num_beams, batch_size in CONFIGS:
+        batch_size = batch_size or args.batch_size
+        convert_texts_to_sql(questions[:batch_size], num_beams=num_beams, batch_size=batch_size, quantize=quantize)  # Warm-up
+        latencies = []
+        total = 0.0
+        for _ in range(args.repeats):
+            outputs = []
+            for first in range(0, len(questions), batch_size):
+                batch = questions[first:first + batch_size]
+                start = time.perf_counter()
+                outputs += convert_texts_to_sql(batch, num_beams=num_beams, batch_size=batch_size, quantize=quantize)
+                elapsed = time.perf_counter() - start
+                total += elapsed
+                latencies += [elapsed] * len(batch)
+        if reference is None:
+            reference = outputs
+        agreement = sum(a == b for a, b in zip(outputs, reference)) / len(outputs)
+        print(f"{name:<22} {percentile(latencies, 0.5) * 1000:9.1f} {percentile(latencies, 0.95) * 1000:9.1f} "
+              f"{len(questions) * args.repeats / total:7.2f} {agreement:17.0%}")
@@ -0,0 +1,354 @@
+import os
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from instrumentation import rss_mb, maxrss_mb, peak_rss_mb
+
+# End-to-end benchmark of the report pipeline: transcription -> schema -> SQL generation ->
+# execution -> charts and PDF, on a synthetic database, against local stand-ins for Groq and
+# Gemini (stub_llm_server.py) and a synthetic audio clip. Each stage is timed over several
+# iterations and the result is written as JSON, so two runs can be compared with --baseline.
+#
+#   python bench_pipeline.py --scale medium --iterations 5 --output bench.json
+#   python bench_pipeline.py --scale medium --baseline bench.json
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+SCALES = {
+    # tables, rows in the fact table
+    "small": (20, 5000),
+    "medium": (100, 200000),
+    "large": (300, 2000000),
+}
+DIMENSION_ROWS = 1000
+DIMENSION_NAMES = ["customers", "products", "stores", "suppliers", "employees", "regions", "campaigns",
+                   "warehouses", "carriers", "promotions"]
+CATEGORIES = ["Electronics", "Grocery", "Clothing", "Toys", "Garden", "Books", "Sports", "Beauty"]
+QUESTION = "What is the total sales amount by category and by month?"
+RSS_SAMPLE_SECONDS = 0.01
+
+def _dimension_tables(tables):
+    names = []
+    for i in range(tables - 1):
+        base = DIMENSION_NAMES[i % len(DIMENSION_NAMES)]
+        names.append(base if i < len(DIMENSION_NAMES) else f"{base}_{i // len(DIMENSION_NAMES)}")
+    return names
+
+def synthesize_database(path, tables, rows):
+    # A "sales" fact table with `rows` rows referencing up to five of `tables - 1` dimension tables.
+    # Rows come from recursive CTEs with multiplicative hashing, so the data is deterministic and
+    # millions of rows take seconds.
+    dimensions = _dimension_tables(tables)
+    linked = dimensions[:5]
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    categories = ", ".join(f"({i}, '{name}')" for i, name in enumerate(CATEGORIES))
+    with conn:
+        for name in dimensions:
+            conn.execute(f"CREATE TABLE {name} (id INTEGER PRIMARY KEY, name TEXT, region TEXT, created TEXT)")
+            conn.execute(f"""
+                WITH RECURSIVE seq(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM seq WHERE i < ?)
+                INSERT INTO {name} SELECT i, '{name[:-1].title()} ' || i, 'Region ' || (i * 7919 % 12),
+                       date('2015-01-01', '+' || (i * 104729 % 3000) || ' days') FROM seq""", (DIMENSION_ROWS,))
+
+        foreign_keys = "".join(f", {name}_id INTEGER REFERENCES {name}(id)" for name in linked)
+        conn.execute(f"CREATE TABLE sales (id INTEGER PRIMARY KEY, sale_date TEXT, category TEXT, quantity INTEGER, "
+                     f"amount REAL{foreign_keys})")
+        linked_values = "".join(f", 1 + (i * {7919 + 2 * k} % {DIMENSION_ROWS})" for k, _ in enumerate(linked))
+        conn.execute(f"""
+            WITH RECURSIVE seq(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM seq WHERE i < ?),
+                 category(k, name) AS (VALUES {categories})
+            INSERT INTO sales
+            SELECT i, date('2018-01-01', '+' || (i * 2654435761 % 2190) || ' days'),
+                   (SELECT name FROM category WHERE k = i * 40503 % {len(CATEGORIES)}),
+                   1 + i * 48271 % 20, round((i * 69621 % 100000) / 100.0 + 5, 2){linked_values}
+            FROM seq""", (rows,))
+    conn.execute("ANALYZE")
+    conn.close()
+    return dimensions
+
+def canned_sql(dimensions):
+    # The Groq stub's answer: a numbered list, like the real model's
+    join = dimensions[0]
+    queries = [
+        "SELECT category, COUNT(*) AS orders, SUM(amount) AS total_amount FROM sales GROUP BY category ORDER BY total_amount DESC;",
+        "SELECT strftime('%Y-%m', sale_date) AS month, SUM(amount) AS total_amount FROM sales GROUP BY month ORDER BY month;",
+        f"SELECT d.name, SUM(s.amount) AS total_amount FROM sales s JOIN {join} d ON s.{join}_id = d.id "
+        "GROUP BY d.name ORDER BY total_amount DESC LIMIT 50;",
+        "SELECT sale_date, amount FROM sales ORDER BY sale_date;",
+        "SELECT quantity, amount FROM sales;",
+    ]
+    return "\n".join(f"{i}. {query}" for i, query in enumerate(queries, start=1))
+
+CANNED_CHART_CODE = '''def visualize_query(query_index, query_data, description=""):
+    plt.figure(figsize=(8, 5))
+    numeric = list(query_data.select_dtypes("number").columns)
+    if numeric and len(query_data.columns) >= 2:
+        x, y = query_data.columns[0], numeric[-1]
+        if x in numeric:
+            plt.scatter(query_data[x], query_data[y], s=4)
+        else:
+            plt.plot(query_data[x].astype(str), query_data[y])
+            plt.xticks([])
+    elif numeric:
+        plt.hist(query_data[numeric[0]].dropna(), bins=30)
+    plt.title(f"Query {query_index}")
+    plt.savefig(description, bbox_inches="tight")
+'''
+
+def canned_gemini_response(payload):
+    # Chart code for the chart prompt, one "queryi:..." line per query for the description prompt
+    prompt = " ".join(part.get("text", "") for content in payload.get("contents", []) for part in content.get("parts", []))
+    if "visualize_query" in prompt:
+        return CANNED_CHART_CODE
+    count = prompt.count("\nQuery ") + prompt.startswith("Query ")
+    return "\n".join(f"query{i}:Synthetic description of query {i}." for i in range(1, max(count, 1) + 1))
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * fraction
+    low = int(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+def summarize(samples):
+    return {"runs": len(samples), "mean": round(sum(samples) / len(samples), 4), "p50": round(percentile(samples, 0.5), 4),
+            "p90": round(percentile(samples, 0.9), 4), "p95": round(percentile(samples, 0.95), 4),
+            "max": round(max(samples), 4)}
+
+class RSSSampler:
+    # Samples this process's resident set size on a thread while a stage runs. ru_maxrss only
+    # reports the lifetime peak, which would repeat the largest stage's figure for every later one.
+    def __init__(self, interval=RSS_SAMPLE_SECONDS):
+        self.interval = interval
+        self.start = None
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, rss_mb() or 0.0)
+
+    def __enter__(self):
+        self.start = rss_mb()
+        if self.start is not None:  # /proc is Linux only
+            self.peak = self.start
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self.start is not None:
+            self._stop.set()
+            self._thread.join()
+            self.peak = max(self.peak, rss_mb() or 0.0)
+
+class StageTimer:
+    def __init__(self):
+        self.samples = {}
+        self.failures = {}
+        self.rss = {}  # stage -> {"peak_rss_mb", "rss_delta_mb", "child_peak_rss_mb"}, maxima over runs
+
+    def _record_rss(self, stage, name, value):
+        if value is not None:
+            entry = self.rss.setdefault(stage, {})
+            entry[name] = max(entry.get(name, value), value)
+
+    def run(self, stage, function, *args, **kwargs):
+        # Returns function's result, or None if it raised; the error is recorded for the stage
+        start = time.perf_counter()
+        try:
+            with RSSSampler() as sampler:
+                result = function(*args, **kwargs)
+        except Exception as e:
+            self.failures[stage] = f"{type(e).__name__}: {e}"
+            return None
+        self.samples.setdefault(stage, []).append(time.perf_counter() - start)
+        if sampler.start is not None:
+            self._record_rss(stage, "peak_rss_mb", round(sampler.peak, 1))
+            self._record_rss(stage, "rss_delta_mb", round(sampler.peak - sampler.start, 1))
+        return result
+
+    def record_child_rss(self, stage, peak_mb):
+        # Peak RSS of a stage's subprocess, which the in-process sampler cannot see
+        self._record_rss(stage, "child_peak_rss_mb", peak_mb)
+
+    def report(self):
+        stages = {}
+        for stage, samples in self.samples.items():
+            stages[stage] = summarize(samples)
+            stages[stage].update(self.rss.get(stage, {}))
+        for stage, error in self.failures.items():
+            stages.setdefault(stage, {})["error"] = error
+        return stages
+
+def run_charts_and_pdf(work_dir, results_dir, gemini_base_url):
+    # GenerateGraph.py runs as its own process, as server.js starts it. Returns the peak RSS in MB
+    # of that process and the chart workers it waited for, or None where wait4 is unavailable.
+    env = dict(os.environ, GEMINI_BASE_URL=gemini_base_url, GOOGLE_GRAPH_API_KEY="stub", LLM_CACHE_BYPASS="1")
+    with tempfile.TemporaryFile("w+") as out, tempfile.TemporaryFile("w+") as err:
+        process = subprocess.Popen([sys.executable, os.path.join(BACKEND_DIR, "GenerateGraph.py"), results_dir],
+                                   cwd=work_dir, env=env, stdout=out, stderr=err, text=True)
+        peak_mb = None
+        if hasattr(os, "wait4"):
+            # Reaps the child itself, so its own rusage is available rather than the cumulative one
+            _, status, usage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+            peak_mb = maxrss_mb(usage)
+        else:
+            process.wait()
+        out.seek(0)
+        err.seek(0)
+        stdout, stderr = out.read(), err.read()
+    if process.returncode != 0 or "PDF saved" not in stdout:
+        raise RuntimeError((stderr or stdout).strip().splitlines()[-1]
+                           if (stderr or stdout).strip() else f"exit code {process.returncode}")
+    return peak_mb
+
+def compare(report, baseline):
+    # Per-stage p50 change against an earlier run
+    lines = []
+    for stage, current in report["stages"].items():
+        previous = baseline.get("stages", {}).get(stage, {})
+        if "p50" in current and previous.get("p50"):
+            change = (current["p50"] - previous["p50"]) / previous["p50"] * 100
+            lines.append(f"{stage:<24} p50 {previous['p50'] * 1000:10.1f} ms -> {current['p50'] * 1000:10.1f} ms  {change:+6.1f}%")
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of the report pipeline with local stand-ins.")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small", help="Synthetic database size preset")
+    parser.add_argument("--tables", type=int, help="Override the number of tables")
+    parser.add_argument("--rows", type=int, help="Override the number of rows in the fact table")
+    parser.add_argument("--iterations", type=int, default=3, help="Timed runs of every stage")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Seconds the stub LLM servers wait before answering")
+    parser.add_argument("--audio-seconds", type=float, default=30.0, help="Length of the synthetic clip, 0 skips transcription")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    parser.add_argument("--baseline", help="Earlier JSON report to compare the p50 latencies against")
+    parser.add_argument("--keep", action="store_true", help="Keep the working directory")
+    args = parser.parse_args()
+
+    tables, rows = SCALES[args.scale]
+    tables = max(2, args.tables or tables)
+    rows = args.rows or rows
+    work_dir = tempfile.mkdtemp(prefix="razorx-bench-")
+    # Caches and the token bucket of this run live in the working directory; these must be set
+    # before the backend modules are imported
+    os.environ["RAZORX_CACHE_DIR"] = os.path.join(work_dir, ".cache")
+    os.environ["LLM_BUCKET_PATH"] = os.path.join(work_dir, ".cache", "llm_bucket.db")
+    os.environ["LLM_TOKENS_PER_MINUTE"] = str(10 ** 9)
+    os.environ["RESULT_CACHE_PATH"] = os.path.join(work_dir, ".cache", "result_cache.db")
+
+    from stub_llm_server import StubLLMServer
+    timer = StageTimer()
+    database_path = os.path.join(work_dir, "database.db")
+    start = time.perf_counter()
+    dimensions = synthesize_database(database_path, tables, rows)
+    setup = {"database_seconds": round(time.perf_counter() - start, 3),
+             "database_mb": round(os.path.getsize(database_path) / 1024 / 1024, 1)}
+
+    server = StubLLMServer(latency=args.llm_latency, response_text=canned_sql(dimensions),
+                           gemini_response_text=canned_gemini_response).start()
+    os.environ["GROQ_API_URL"] = server.url
+    os.environ["GROQ_API_KEY"] = "stub"
+    try:
+        import get_schema
+        import schema_index
+        from generate_sql import generate_sql_via_api
+        from execute_queries import execute_queries
+
+        transcribe_fn = None
+        clip_path = None
+        if args.audio_seconds > 0:
+            sys.path.insert(0, os.path.join(BACKEND_DIR, "whisper"))
+            try:
+                from bench_long_audio import synthesize_clip
+                clip_path = os.path.join(work_dir, "question.wav")
+                synthesize_clip(clip_path, args.audio_seconds / 60)
+                from transcribe import get_model, transcribe
+            except Exception as e:
+                # openai-whisper/torch not installed
+                timer.failures["transcribe"] = f"skipped: {type(e).__name__}: {e}"
+            else:
+                if timer.run("transcribe_model_load", get_model) is not None:
+                    transcribe_fn = transcribe
+
+        results_dir = os.path.join(work_dir, "sql_results")
+        executed_rows = 0
+        for _ in range(args.iterations):
+            if transcribe_fn is not None:
+                timer.run("transcribe", transcribe_fn, clip_path)
+
+            # Each /execute request is a fresh process, so only the on-disk caches carry over
+            get_schema._memory_cache.clear()
+            schema_index._memory_index.clear()
+            timer.run("schema_introspect_cold", get_schema.load_schema, database_path, use_cache=False)
+            get_schema._memory_cache.clear()
+            timer.run("schema_load_cached", get_schema.load_schema, database_path)
+            schema_index._memory_index.clear()
+            pruned = timer.run("schema_prune", schema_index.prune_schema, database_path, QUESTION)
+            if pruned is None:
+                break
+
+            queries = timer.run("sql_generation", generate_sql_via_api, QUESTION, pruned["schema"], True)
+            if not queries:
+                break
+
+            entries = timer.run("execute", execute_queries, database_path, queries, results_dir, use_cache=False)
+            if entries:
+                executed_rows += sum(entry["row_count"] for entry in entries)
+            # A repeated report is answered from the result cache; the first run fills it
+            execute_queries(database_path, queries, results_dir)
+            timer.run("execute_cached", execute_queries, database_path, queries, results_dir)
+
+            if "charts_and_pdf" not in timer.failures:
+                timer.record_child_rss("charts_and_pdf", timer.run("charts_and_pdf", run_charts_and_pdf, work_dir,
+                                                                   results_dir, server.gemini_base_url))
+    finally:
+        server.stop()
+
+    stages = timer.report()
+    pipeline = ["transcribe", "schema_prune", "sql_generation", "execute", "charts_and_pdf"]
+    pipeline_seconds = sum(stages[stage]["mean"] for stage in pipeline if "mean" in stages.get(stage, {}))
+    throughput = {"pipelines_per_minute": round(60 / pipeline_seconds, 2) if pipeline_seconds else None}
+    if "mean" in stages.get("execute", {}):
+        throughput["execute_rows_per_second"] = round(executed_rows / (stages["execute"]["mean"] * stages["execute"]["runs"]))
+    if "mean" in stages.get("transcribe", {}):
+        throughput["transcribe_realtime_factor"] = round(args.audio_seconds / stages["transcribe"]["mean"], 2)
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {"scale": args.scale, "tables": tables, "rows": rows, "iterations": args.iterations,
+                   "llm_latency": args.llm_latency, "audio_seconds": args.audio_seconds},
+        "environment": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "setup": setup,
+        "stages": stages,
+        "pipeline_mean_seconds": round(pipeline_seconds, 4),
+        "throughput": throughput,
+        "peak_rss_mb": {"self": peak_rss_mb(), "children": peak_rss_mb("children")},
+        "llm_stub": server.stats,
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            print(compare(report, json.load(f)))
+
+    if args.keep:
+        print(f"Working directory kept at {work_dir}", file=sys.stderr)
+    else:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
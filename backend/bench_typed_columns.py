@@ -0,0 +1,94 @@
+import os
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+from ingest import build_typed_database
+
+PRODUCTS = ["Carretera", "Montana", "Paseo", "Velo", "VTT", "Amarilla"]
+COUNTRIES = ["Canada", "Germany", "France", "Mexico", "United States of America"]
+SEGMENTS = ["Government", "Midmarket", "Channel Partners", "Enterprise", "Small Business"]
+
+def currency(value):
+    # Accounting format used by the sample Financials sheet: " $1,618.50 ", " $(1,618.50)", " $-   "
+    if value == 0:
+        return " $-   "
+    if value < 0:
+        return f" $({-value:,.2f})"
+    return f" ${value:,.2f} "
+
+def synthesize_database(path, rows, seed=0):
+    # A Financials-like table whose numbers and dates are stored as formatted text
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE Financials ("Segment" TEXT, "Country" TEXT, "Product" TEXT, "Units Sold" TEXT, '
+                 '"Sale Price" TEXT, "Sales" TEXT, "Profit" TEXT, "Date" TEXT, "Year" INTEGER)')
+
+    def generate():
+        for _ in range(rows):
+            units = round(rng.uniform(200, 4500), 1)
+            price = rng.choice([7, 12, 15, 20, 125, 300, 350])
+            sales = units * price
+            profit = 0 if rng.random() < 0.01 else round(sales * rng.uniform(-0.1, 0.4), 2)
+            year = rng.choice([2013, 2014])
+            yield (rng.choice(SEGMENTS), rng.choice(COUNTRIES), rng.choice(PRODUCTS), currency(units),
+                   currency(price), currency(sales), currency(profit), f"{rng.randint(1, 12):02d}/01/{year}", year)
+
+    with conn:
+        conn.executemany("INSERT INTO Financials VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", generate())
+    conn.close()
+
+def text_number(column):
+    # What the LLM has to write to get a number out of a formatted text column
+    return f"CAST(REPLACE(REPLACE(REPLACE(TRIM(\"{column}\"), '$', ''), ',', ''), '-', '') AS REAL)"
+
+# The same question asked against the text columns and against the typed companions
+QUERIES = [
+    ("Total sales by product",
+     f"SELECT Product, SUM({text_number('Sales')}) FROM Financials GROUP BY Product",
+     'SELECT Product, SUM("Sales_value") FROM Financials GROUP BY Product'),
+    ("Top 10 sales",
+     f"SELECT * FROM Financials ORDER BY {text_number('Sales')} DESC LIMIT 10",
+     'SELECT * FROM Financials ORDER BY "Sales_value" DESC LIMIT 10'),
+    ("Units sold above 4000",
+     f"SELECT COUNT(*) FROM Financials WHERE {text_number('Units Sold')} > 4000",
+     'SELECT COUNT(*) FROM Financials WHERE "Units Sold_value" > 4000'),
+    ("Monthly sales in 2014",
+     f"SELECT SUBSTR(\"Date\", 1, 2) AS month, SUM({text_number('Sales')}) FROM Financials "
+     "WHERE SUBSTR(\"Date\", 7, 4) = '2014' GROUP BY month ORDER BY month",
+     "SELECT strftime('%m', \"Date_date\") AS month, SUM(\"Sales_value\") FROM Financials "
+     "WHERE \"Date_date\" BETWEEN '2014-01-01' AND '2014-12-31' GROUP BY month ORDER BY month"),
+]
+
+def time_query(conn, sql, repeats):
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        conn.execute(sql).fetchall()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare text-parsing queries with queries on the typed copy.")
+    parser.add_argument("--rows", type=int, default=200000, help="Rows in the synthetic Financials table")
+    parser.add_argument("--repeats", type=int, default=3, help="Runs per query, the fastest is reported")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    database_path = os.path.join(directory, "database.db")
+    synthesize_database(database_path, args.rows)
+
+    start = time.perf_counter()
+    typed_path, typed_columns, _ = build_typed_database(database_path)
+    print(f"Typed copy of {args.rows} rows built in {time.perf_counter() - start:.2f}s "
+          f"({', '.join(column['column'] for column in typed_columns)})")
+
+    text_conn = sqlite3.connect(database_path)
+    typed_conn = sqlite3.connect(typed_path)
+    for name, text_sql, typed_sql in QUERIES:
+        text_seconds = time_query(text_conn, text_sql, args.repeats)
+        typed_seconds = time_query(typed_conn, typed_sql, args.repeats)
+        print(f"{name:<24} text {text_seconds * 1000:9.1f} ms   typed {typed_seconds * 1000:9.1f} ms   "
+              f"{text_seconds / typed_seconds:6.1f}x")
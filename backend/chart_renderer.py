@@ -0,0 +1,206 @@
+import os
+import time
+import multiprocessing
+from multiprocessing.connection import wait
+from instrumentation import add_span, count
+
+# Renders each chart in a pool of worker processes. Every worker execs the generated code once,
+# then receives (index, result entry, filename) tasks over its own pipe. A chart that runs past
+# its time limit gets its worker killed and replaced, and so does a worker whose exec of the
+# generated code does not finish within the same limit; the memory limit is enforced per worker.
+# Large results are reduced (see downsample.py) inside the worker before they are plotted.
+DEFAULT_CHART_TIMEOUT = 60.0
+DEFAULT_MEMORY_LIMIT_MB = 2048
+
+def _limit_memory(memory_limit_mb):
+    # Address-space limit, only available on POSIX
+    try:
+        import resource
+    except ImportError:
+        return
+    limit = memory_limit_mb * 1024 * 1024
+    try:
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ValueError, OSError):
+        pass
+
+def _worker_main(conn, generated_code, memory_limit_mb, reduce_data):
+    import matplotlib
+    matplotlib.use("Agg")  # Non-interactive backend, workers never open windows
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    import pandas as pd
+    from result_store import load_frame
+    from downsample import reduce_frame
+
+    if memory_limit_mb:
+        _limit_memory(memory_limit_mb)
+
+    exec_env = {"os": os, "plt": plt, "sns": sns, "pd": pd, "data_sets": {}}
+    start = time.perf_counter()
+    try:
+        exec(generated_code, exec_env)
+        if "visualize_query" not in exec_env:
+            raise NameError("No visualization function found in generated code.")
+    except Exception as e:
+        conn.send(("ready", f"{type(e).__name__}: {e}", time.perf_counter() - start))
+        return
+    conn.send(("ready", None, time.perf_counter() - start))
+
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        index, entry, filename = task
+        start = time.perf_counter()
+        error = None
+        reduction = None
+        timings = {}
+        try:
+            step = time.perf_counter()
+            query_data = load_frame(entry)
+            timings["load_seconds"] = time.perf_counter() - step
+            if reduce_data:
+                step = time.perf_counter()
+                query_data, reduction = reduce_frame(query_data)
+                timings["reduce_seconds"] = time.perf_counter() - step
+            step = time.perf_counter()
+            exec_env["visualize_query"](index, query_data, description=filename)
+            timings["plot_seconds"] = time.perf_counter() - step
+        except MemoryError:
+            error = f"Chart exceeded the {memory_limit_mb} MB memory limit"
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        finally:
+            plt.close("all")
+        conn.send(("done", index, error, time.perf_counter() - start, reduction, timings))
+
+class _Worker:
+    def __init__(self, context, generated_code, memory_limit_mb, reduce_data, ready_timeout):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn, generated_code, memory_limit_mb, reduce_data),
+                                       daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.ready = False
+        self.task = None
+        # Until "ready", the deadline covers interpreter start-up and the exec of the generated code
+        self.deadline = time.monotonic() + ready_timeout
+
+    def assign(self, task, chart_timeout):
+        self.task = task
+        self.deadline = time.monotonic() + chart_timeout
+        self.conn.send(task)
+
+    def stop(self, kill=False):
+        if kill:
+            self.process.kill()
+        else:
+            try:
+                self.conn.send(None)
+            except (OSError, ValueError):
+                pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.kill()
+        self.conn.close()
+
+def render_charts(generated_code, jobs, workers=None, chart_timeout=DEFAULT_CHART_TIMEOUT,
+                  memory_limit_mb=DEFAULT_MEMORY_LIMIT_MB, on_result=None, reduce_data=True):
+    # jobs: list of (index, result_entry, filename). Returns {index: {"filename", "error", "seconds",
+    # "reduction"}} and calls on_result(index, outcome) as each chart finishes, in completion order.
+    # "reduction" describes how the data was downsampled for plotting, or is None. Each chart and
+    # each worker's exec of the generated code is recorded as a span of the current trace.
+    results = {}
+    if not jobs:
+        return results
+
+    def finish(index, filename, error, seconds, reduction=None, timings=None):
+        outcome = {"filename": filename, "error": error, "seconds": seconds, "reduction": reduction}
+        attributes = {name: round(value, 6) for name, value in (timings or {}).items()}
+        if error:
+            attributes["error"] = error
+            count("charts.failed")
+        add_span("chart", seconds, index=index, rows=jobs_by_index[index][1].get("row_count"),
+                 reduced=reduction is not None, **attributes)
+        results[index] = outcome
+        if on_result:
+            on_result(index, outcome)
+
+    # spawn gives every worker a clean interpreter, independent of what the parent imported
+    context = multiprocessing.get_context("spawn")
+    pending = list(jobs)
+    jobs_by_index = {job[0]: job for job in jobs}
+    worker_count = max(1, min(workers or os.cpu_count() or 1, len(pending)))
+    pool = [_Worker(context, generated_code, memory_limit_mb, reduce_data, chart_timeout) for _ in range(worker_count)]
+
+    try:
+        while pending or any(worker.task for worker in pool):
+            # Hand out work to idle workers
+            for worker in pool:
+                if worker.ready and worker.task is None and pending:
+                    worker.assign(pending.pop(0), chart_timeout)
+
+            deadlines = [worker.deadline for worker in pool if worker.deadline is not None]
+            timeout = max(min(deadlines) - time.monotonic(), 0) if deadlines else None
+            ready_conns = wait([worker.conn for worker in pool], timeout)
+
+            for i, worker in enumerate(pool):
+                replace = False
+                if worker.conn in ready_conns:
+                    try:
+                        message = worker.conn.recv()
+                    except EOFError:
+                        message = None
+
+                    if message is None:
+                        # The worker died (crash, OOM kill); fail its chart and start a fresh one
+                        if worker.task:
+                            index, _, filename = worker.task
+                            finish(index, filename, "Chart worker crashed", None)
+                        elif not worker.ready:
+                            raise RuntimeError("Chart worker exited before it was ready")
+                        replace = True
+                    elif message[0] == "ready":
+                        add_span("chart.exec", message[2], failed=bool(message[1]))
+                        if message[1]:
+                            # The generated code itself is broken, no chart can be rendered
+                            raise RuntimeError(message[1])
+                        worker.ready = True
+                        worker.deadline = None
+                    else:
+                        _, index, error, seconds, reduction, timings = message
+                        finish(index, worker.task[2], error, seconds, reduction, timings)
+                        worker.task = None
+                        worker.deadline = None
+                elif worker.deadline is not None and time.monotonic() > worker.deadline:
+                    if not worker.ready:
+                        # Top-level code that loops or blocks would hang every worker the same way
+                        worker.stop(kill=True)
+                        pool[i] = None
+                        add_span("chart.exec", chart_timeout, failed=True)
+                        raise RuntimeError(f"Generated code did not finish loading within {chart_timeout:.0f}s")
+                    index, _, filename = worker.task
+                    finish(index, filename, f"Chart timed out after {chart_timeout:.0f}s", None)
+                    replace = True
+
+                if replace:
+                    worker.stop(kill=True)
+                    # Only start a replacement if there is still work for it
+                    pool[i] = _Worker(context, generated_code, memory_limit_mb, reduce_data, chart_timeout) if pending else None
+            pool = [worker for worker in pool if worker is not None]
+    except RuntimeError as e:
+        in_flight = [worker.task for worker in pool if worker and worker.task]
+        for index, _, filename in pending + in_flight:
+            if index not in results:
+                finish(index, filename, str(e), None)
+    finally:
+        for worker in pool:
+            if worker:
+                # A busy worker, or one still in the generated code, would not read the stop message
+                worker.stop(kill=worker.task is not None or not worker.ready)
+
+    return results
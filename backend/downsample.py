@@ -0,0 +1,202 @@
+import re
+import warnings
+import numpy as np
+
+# Shrinks a query result before it is handed to the generated visualize_query, so matplotlib never
+# draws hundreds of thousands of markers. The reduction is picked from the column dtypes:
+#   - an ordered x (dates, or a sorted numeric column) with numeric y: LTTB downsampling per series
+#   - two or more unordered numeric columns: density-preserving grid sampling for scatter plots
+#   - a text column with too many distinct values: top-N categories plus "Other"
+# Each reduction returns a short note that ends up in the chart's description in the report.
+MAX_ROWS = 5000  # Results at or below this size are plotted as they are
+MAX_POINTS = 2000  # Points kept per reduced chart
+SCATTER_BINS = 200  # Grid resolution for scatter reduction
+MAX_CATEGORIES = 30  # More distinct values than this get grouped
+TOP_CATEGORIES = 20
+OTHER_LABEL = "Other"
+_DATE_RE = re.compile(r"^\d{4}-\d{2}(-\d{2})?([ T]\d{2}:\d{2}(:\d{2})?)?")
+
+def lttb_indices(x, y, n_out):
+    # Largest-Triangle-Three-Buckets: keeps the first and last point, and from each bucket in
+    # between the point forming the largest triangle with the previously kept point and the
+    # average of the next bucket. x must be sorted. Returns indices into x/y.
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+def grid_sample_indices(x, y, n_out, bins=SCATTER_BINS, seed=0):
+    # Samples rows on a grid: every occupied cell keeps at least one row (outliers and the outline
+    # survive) and dense cells keep rows in proportion to their count (density survives). The grid
+    # is coarsened until the occupied cells leave room for that. Returns (indices, bins used).
+    n = len(x)
+    if n_out >= n:
+        return np.arange(n), None
+
+    def cells(values, bins):
+        low, high = values.min(), values.max()
+        if high == low:
+            return np.zeros(n, dtype=np.int64)
+        return np.clip(((values - low) / (high - low) * bins).astype(np.int64), 0, bins - 1)
+
+    while True:
+        cell = cells(x, bins) * bins + cells(y, bins)
+        occupied = len(np.unique(cell))
+        if occupied <= n_out // 2 or bins <= 2:
+            break
+        bins //= 2
+
+    # Random order within each cell, so the kept rows are not biased by the result's ORDER BY
+    order = np.random.default_rng(seed).permutation(n)
+    order = order[np.argsort(cell[order], kind="stable")]
+    _, starts, counts = np.unique(cell[order], return_index=True, return_counts=True)
+    rank = np.arange(n) - np.repeat(starts, counts)
+    quota = np.maximum(1, np.floor(counts * ((n_out - occupied) / n))).astype(np.int64)
+    return np.sort(order[rank < np.repeat(quota, counts)]), bins
+
+def _numeric_values(series):
+    import pandas as pd
+    if pd.api.types.is_datetime64_any_dtype(series):
+        values = series.astype("int64").to_numpy(dtype=float)
+        values[series.isna().to_numpy()] = np.nan  # NaT converts to the minimum int64, not NaN
+        return values
+    return pd.to_numeric(series, errors="coerce").to_numpy(dtype=float)
+
+def _as_dates(series):
+    # Text dates as SQLite returns them ("2014-06-01", "2014-06-01 12:00:00"), else None
+    import pandas as pd
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    sample = series.dropna().head(50)
+    if sample.empty or not all(isinstance(value, str) and _DATE_RE.match(value) for value in sample):
+        return None
+    with warnings.catch_warnings():
+        # Mixed date/datetime strings warn about format inference; nothing may reach stderr
+        warnings.simplefilter("ignore")
+        dates = pd.to_datetime(series, errors="coerce")
+    return dates if dates.notna().mean() >= 0.9 else None
+
+def _classify(frame):
+    import pandas as pd
+    numeric, dates, text = [], {}, []
+    for column in frame.columns:
+        series = frame[column]
+        if pd.api.types.is_bool_dtype(series):
+            text.append(column)
+        elif pd.api.types.is_numeric_dtype(series):
+            numeric.append(column)
+        else:
+            parsed = _as_dates(series)
+            if parsed is not None:
+                dates[column] = parsed
+            else:
+                text.append(column)
+    return numeric, dates, text
+
+def _reduce_categories(frame, column, numeric):
+    # Keeps the TOP_CATEGORIES largest categories (by the first numeric column, else by row count)
+    import pandas as pd
+    values = frame[column]
+    distinct = values.nunique(dropna=True)
+    if numeric:
+        weights = frame.groupby(column, dropna=True)[numeric[0]].sum().abs()
+    else:
+        weights = values.value_counts(dropna=True)
+    keep = set(weights.sort_values(ascending=False, kind="stable").index[:TOP_CATEGORIES])
+    is_top = values.isin(keep) | values.isna()
+
+    if distinct == values.notna().sum():
+        # Already one row per category (a GROUP BY result): the rest collapses into one "Other" row
+        reduced = frame[is_top]
+        rest = frame[~is_top]
+        other = {name: (rest[name].sum() if name in numeric else None) for name in frame.columns}
+        other[column] = OTHER_LABEL
+        reduced = pd.concat([reduced, pd.DataFrame([other], columns=frame.columns)], ignore_index=True)
+    else:
+        # Raw rows: relabel the long tail so per-row plots (box plots, counts) keep every row
+        reduced = frame.copy()
+        reduced[column] = values.where(is_top, OTHER_LABEL)
+    return reduced, f'"{column}": top {TOP_CATEGORIES} of {distinct} categories shown, the rest grouped as "{OTHER_LABEL}"'
+
+def _reduce_series(frame, x_column, x_values, y_columns, group_columns, max_points):
+    # LTTB within each series (one per combination of the grouping columns), over every y column
+    order = np.argsort(x_values, kind="stable")
+    frame = frame.iloc[order]
+    x_values = x_values[order]
+    groups = [np.arange(len(frame))] if not group_columns else [
+        np.asarray(positions) for positions in frame.reset_index(drop=True).groupby(group_columns, dropna=False, sort=False).indices.values()
+    ]
+    budget = max(max_points // (len(groups) * len(y_columns)), 3)
+    keep = []
+    for positions in groups:
+        for y_column in y_columns:
+            y_values = _numeric_values(frame[y_column].iloc[positions])
+            valid = np.isfinite(x_values[positions]) & np.isfinite(y_values)
+            valid_positions = positions[valid]
+            keep.append(valid_positions[lttb_indices(x_values[valid_positions], y_values[valid], budget)])
+    keep = np.unique(np.concatenate(keep)) if keep else np.arange(0)
+    series = f" per {', '.join(group_columns)}" if group_columns else ""
+    note = (f"{len(frame)} rows downsampled to {len(keep)} with LTTB on {', '.join(y_columns)} over "
+            f"{x_column}{series}, preserving peaks and trend")
+    return frame.iloc[keep].reset_index(drop=True), note
+
+def reduce_frame(frame, max_rows=MAX_ROWS, max_points=MAX_POINTS):
+    # Returns (frame, note): the frame to plot and a sentence describing the reduction, or
+    # (frame, None) when it is plotted as is
+    if frame.empty or not len(frame.columns):
+        return frame, None
+    numeric, dates, text = _classify(frame)
+    notes = []
+
+    # Too many categories is unreadable at any row count
+    wide = [column for column in text if frame[column].nunique(dropna=True) > MAX_CATEGORIES]
+    if len(wide) == 1 and len(text) == 1:
+        frame, note = _reduce_categories(frame, wide[0], numeric)
+        notes.append(note)
+
+    if len(frame) > max_rows:
+        group_columns = [column for column in text if frame[column].nunique(dropna=True) <= MAX_CATEGORIES]
+        x_column = next(iter(dates), None)
+        if x_column is not None:
+            # Relabelling categories keeps every row, so the parsed dates still line up with the frame
+            x_values = _numeric_values(dates[x_column])
+            y_columns = numeric
+        elif len(numeric) >= 2 and frame[numeric[0]].is_monotonic_increasing:
+            # A sorted numeric first column (ids, years, offsets) reads as the x of a line
+            x_column = numeric[0]
+            x_values = _numeric_values(frame[x_column])
+            y_columns = numeric[1:]
+        else:
+            y_columns = []
+
+        if x_column is not None and y_columns:
+            frame, note = _reduce_series(frame, x_column, x_values, y_columns, group_columns, max_points)
+            notes.append(note)
+        elif len(numeric) >= 2:
+            x_values = _numeric_values(frame[numeric[0]])
+            y_values = _numeric_values(frame[numeric[1]])
+            valid = np.flatnonzero(np.isfinite(x_values) & np.isfinite(y_values))
+            # Few plottable points means nothing to thin out, and the frame is left as it is
+            if len(valid) > max_points:
+                indices, bins = grid_sample_indices(x_values[valid], y_values[valid], max_points)
+                keep = valid[indices]
+                note = (f"{len(frame)} rows sampled to {len(keep)} on a {bins}x{bins} grid of "
+                        f"{numeric[0]} and {numeric[1]}, keeping every occupied region and the relative density")
+                if len(valid) < len(frame):
+                    note += f" ({len(frame) - len(valid)} rows without both values left out)"
+                notes.append(note)
+                frame = frame.iloc[keep].reset_index(drop=True)
+
+    return frame, "; ".join(notes) if notes else None
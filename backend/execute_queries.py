@@ -0,0 +1,206 @@
+import os
+import sys
+import json
+import time
+import queue
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+import result_cache
+from get_schema import database_fingerprint
+from instrumentation import request, count, add_span
+from result_store import (RESULTS_DIR, prepare_results_dir, write_query_result, write_query_ndjson, write_manifest,
+                          json_value)
+
+# Runs the generated queries concurrently on a pool of read-only connections and streams each
+# result straight into the sql_results/ hand-off read by GenerateGraph.py. sqlite3 releases the
+# GIL while a statement steps, so threads give real parallelism here. Results of queries already
+# run against the same database contents are served from result_cache.py.
+DEFAULT_WORKERS = 4
+STATEMENT_TIMEOUT = float(os.environ.get("SQL_STATEMENT_TIMEOUT", "10"))
+MAX_ROWS = int(os.environ.get("SQL_MAX_ROWS", "200000"))
+PREVIEW_ROWS = 1000  # Rows per query returned to the frontend, the full result stays on disk
+FETCH_BATCH = 1000
+PROGRESS_STEPS = 10000  # SQLite VM instructions between deadline checks
+MMAP_SIZE = 256 * 1024 * 1024
+CACHE_SIZE_KB = 64 * 1024
+
+def connect_pooled(database_path):
+    conn = sqlite3.connect(f"file:{database_path}?mode=ro", uri=True, check_same_thread=False)
+    conn.execute("PRAGMA query_only = 1")
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KB}")  # Negative means KiB rather than pages
+    return conn
+
+def _result_columns(conn, query):
+    # Column names of a query without running it. The newlines keep a trailing -- comment from
+    # swallowing the closing parenthesis.
+    cursor = conn.execute(f"SELECT * FROM (\n{query.strip().rstrip(';')}\n) LIMIT 0")
+    return [description[0] for description in cursor.description or []]
+
+def _serve_cached(conn, results_dir, index, query, cached, preview_rows):
+    # Writes a cached result to the hand-off without decoding it, apart from the preview rows
+    columns = cached["columns"]
+    # SQLite names unaliased expression columns after their exact text, so a cached result of a
+    # differently formatted query is only reused if the names come out the same
+    if cached["query"] != query and _result_columns(conn, query) != columns:
+        return None
+    entry = write_query_ndjson(results_dir, index, query, columns, cached["data"], cached["row_count"])
+    lines = cached["data"].split(b"\n", preview_rows)[:preview_rows]
+    entry["truncated"] = cached["truncated"]
+    entry["cached"] = True
+    entry["preview"] = [dict(zip(columns, json.loads(line))) for line in lines if line.strip()]
+    return entry
+
+def _run_query(pool, results_dir, index, query, statement_timeout, max_rows, preview_rows,
+               database_path=None, fingerprint=None):
+    conn = pool.get()
+    start = time.perf_counter()
+    if fingerprint is not None:
+        # The result cache is best-effort: a locked, corrupt or unwritable cache file only means
+        # the query is run
+        try:
+            cached = result_cache.get(fingerprint, query, max_rows)
+        except (sqlite3.Error, OSError):
+            cached = None
+        if cached is not None:
+            try:
+                entry = _serve_cached(conn, results_dir, index, query, cached, preview_rows)
+            except sqlite3.Error:
+                entry = None
+            if entry is not None:
+                pool.put(conn)
+                entry["seconds"] = round(time.perf_counter() - start, 4)
+                entry["bytes_saved"] = cached["raw_bytes"]
+                add_span("sql.query", entry["seconds"], index=index, rows=entry["row_count"], cached=True)
+                return entry
+    deadline = time.monotonic() + statement_timeout
+    # Returning non-zero from the progress handler interrupts the running statement
+    conn.set_progress_handler(lambda: 1 if time.monotonic() > deadline else 0, PROGRESS_STEPS)
+    preview = []
+    columns = []
+    truncated = False
+
+    try:
+        cursor = conn.execute(query)
+        columns = [description[0] for description in cursor.description or []]
+
+        def rows():
+            nonlocal truncated
+            fetched = 0
+            while fetched < max_rows:
+                batch = cursor.fetchmany(min(FETCH_BATCH, max_rows - fetched))
+                if not batch:
+                    return
+                for row in batch:
+                    if len(preview) < preview_rows:
+                        preview.append(row)
+                    yield row
+                fetched += len(batch)
+            # One more row tells a capped result apart from one that was exactly max_rows long
+            truncated = cursor.fetchone() is not None
+
+        entry = write_query_result(results_dir, index, query, columns, rows())
+    except sqlite3.Error as e:
+        if isinstance(e, sqlite3.OperationalError) and str(e) == "interrupted":
+            error = f"Query exceeded the {statement_timeout:g}s time limit"
+        else:
+            error = str(e)
+        # Drop any rows streamed before the failure
+        partial_path = os.path.join(results_dir, f"query{index}.ndjson")
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        entry = write_query_result(results_dir, index, query, columns, None, error=error)
+        preview = []
+    finally:
+        conn.set_progress_handler(None, 0)
+        pool.put(conn)
+
+    entry["truncated"] = truncated
+    entry["cached"] = False
+    entry["seconds"] = round(time.perf_counter() - start, 4)
+    entry["preview"] = [{name: json_value(value) for name, value in zip(columns, row)} for row in preview]
+    attributes = {"error": entry["error"]} if "error" in entry else {}
+    add_span("sql.query", entry["seconds"], index=index, rows=entry["row_count"], cached=False, **attributes)
+
+    # Only complete, successful results are cached; a timed out query may succeed next time
+    if fingerprint is not None and "error" not in entry:
+        path = os.path.join(results_dir, entry["file"])
+        try:
+            if os.path.getsize(path) <= result_cache.MAX_ENTRY_BYTES:
+                with open(path, "rb") as f:
+                    result_cache.put(database_path, fingerprint, query, max_rows, columns, entry["row_count"],
+                                     truncated, f.read())
+        except (sqlite3.Error, OSError):
+            pass
+    return entry
+
+def execute_queries(database_path, queries, results_dir=RESULTS_DIR, workers=DEFAULT_WORKERS,
+                    statement_timeout=STATEMENT_TIMEOUT, max_rows=MAX_ROWS, preview_rows=PREVIEW_ROWS,
+                    use_cache=True):
+    # Returns the manifest entries in query order, each with its timing, row count, whether it
+    # was capped at max_rows, whether it came from the result cache, and up to preview_rows rows
+    # as dicts
+    prepare_results_dir(results_dir)
+    fingerprint = database_fingerprint(database_path) if use_cache else None
+    workers = max(1, min(workers, len(queries)))
+    pool = queue.Queue()
+    for _ in range(workers):
+        pool.put(connect_pooled(database_path))
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(_run_query, pool, results_dir, i, query, statement_timeout, max_rows, preview_rows,
+                                database_path, fingerprint)
+                for i, query in enumerate(queries, start=1)
+            ]
+            entries = [future.result() for future in futures]
+    finally:
+        while not pool.empty():
+            pool.get().close()
+
+    if fingerprint is not None:
+        hits = [entry for entry in entries if entry["cached"]]
+        count("result_cache.hits", len(hits))
+        count("result_cache.misses", len(entries) - len(hits))
+        try:
+            result_cache.record(len(hits), len(entries) - len(hits), sum(entry["bytes_saved"] for entry in hits))
+        except (sqlite3.Error, OSError):
+            pass
+
+    # The preview and cache accounting are only for the caller, the manifest keeps the rest
+    write_manifest(results_dir, [{k: v for k, v in entry.items() if k not in ("preview", "cached", "bytes_saved")}
+                                 for entry in entries])
+    return entries
+
+# Usage: python execute_queries.py <database> [results_dir]   (JSON list of queries on stdin)
+# Prints {"results": [{"query", "rows", "row_count", "truncated", "cached", "seconds", "error"?}, ...],
+#         "seconds", "result_cache": {"hits", "misses", "hit_rate", "bytes_saved"}, "results_dir"}
+# The server gives each request its own results_dir, so a report still rendering from one
+# run's files isn't cut short by the next /execute clearing them
+if __name__ == "__main__":
+    from ingest import resolve_database
+    DATABASE_PATH = resolve_database(sys.argv[1] if len(sys.argv) > 1 else "database.db")
+    results_dir = sys.argv[2] if len(sys.argv) > 2 else RESULTS_DIR
+    try:
+        queries = json.load(sys.stdin)
+        start = time.perf_counter()
+        with request("execute_queries", queries=len(queries)):
+            entries = execute_queries(DATABASE_PATH, queries, results_dir) if queries else []
+            if not queries:
+                write_manifest(prepare_results_dir(results_dir), [])
+        results = []
+        for entry in entries:
+            result = {"query": entry["query"], "rows": entry["preview"], "row_count": entry["row_count"],
+                      "truncated": entry["truncated"], "cached": entry["cached"], "seconds": entry["seconds"]}
+            if "error" in entry:
+                result["error"] = entry["error"]
+            results.append(result)
+        hits = sum(1 for entry in entries if entry["cached"])
+        cache_stats = {"hits": hits, "misses": len(entries) - hits,
+                       "hit_rate": round(hits / len(entries), 3) if entries else 0.0,
+                       "bytes_saved": sum(entry.get("bytes_saved", 0) for entry in entries)}
+        print(json.dumps({"results": results, "seconds": round(time.perf_counter() - start, 4),
+                          "result_cache": cache_stats, "results_dir": results_dir}, default=str))
+    except Exception as e:
+        print(json.dumps({"error": str(e)}))
@@ -1,17 +1,34 @@
 import os
+import hashlib
 import requests
+import llm_cache
+from llm_client import get_client
+from ingest import resolve_database
+from schema_index import DEFAULT_TOKEN_BUDGET, prune_schema
 
-def generate_sql_via_api(question, schema):
+MODEL_NAME = "llama-3.3-70b-versatile"  # Adjust the model as needed
+# Bump when the prompt changes so cached answers to the old prompt are not reused
+PROMPT_VERSION = 2
+ERROR_RESPONSE = ["Error generating SQL queries."]
+
+def generate_sql_via_api(question, schema, bypass_cache=False):
     if not question.strip():  # If the question is empty or just whitespace
         return ["No query found."]
 
-    # Set the endpoint and headers
+    # Repeated questions against an unchanged schema are answered from the cache
+    schema_fingerprint = hashlib.sha1(schema.encode("utf-8")).hexdigest()[:16]
+    return llm_cache.cached_call(
+        "generate_sql", question, schema_fingerprint, MODEL_NAME, PROMPT_VERSION,
+        lambda: _request_sql(question, schema),
+        bypass=bypass_cache,
+        should_cache=lambda queries: queries != ERROR_RESPONSE,
+    )
+
+def _request_sql(question, schema):
+    # Set the endpoint; the shared client holds the auth headers and pooled connections
     url = os.getenv('GROQ_API_URL', 'https://api.groq.com/openai/v1/chat/completions')
     api_key = os.getenv('GROQ_API_KEY')
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
+    client = get_client(url, api_key)
 
     # Modify prompt to request multiple queries
     prompt = (
@@ -19,19 +36,20 @@ def generate_sql_via_api(question, schema):
         f"Question: {question}\n\n"
         f"Generate all RELEVANT SQLite3 (SQL) queries needed to extract useful insights for reports and trends. "
         f"Ensure they are diverse and meaningful. "
+        f"Where a table lists \"typed\" columns, use them instead of CAST/REPLACE on the text column. "
         f"Return them as a numbered list with each query on a new line. "
         f"Do not include explanations, just the queries."
     )
 
     # Prepare the payload for the API request
     payload = {
-        "model": "llama-3.3-70b-versatile",  # Adjust the model as needed
+        "model": MODEL_NAME,
         "messages": [{"role": "user", "content": prompt}]
     }
 
     try:
-        # Make the API request
-        response = requests.post(url, json=payload, headers=headers)
+        # Make the API request, queued behind the tokens-per-minute budget and retried on 429/5xx
+        response = client.chat(payload)
 
         if response.status_code == 200:
             result = response.json()
@@ -42,7 +60,15 @@ def generate_sql_via_api(question, schema):
             return queries
         else:
             print(f"Error: {response.status_code}, {response.text}")
-            return ["Error generating SQL queries."]
+            return list(ERROR_RESPONSE)
     except requests.exceptions.RequestException as e:
         print(f"API request error: {e}")
-        return ["Error generating SQL queries."]
+        return list(ERROR_RESPONSE)
+
+def generate_sql_for_database(question, database_path, token_budget=DEFAULT_TOKEN_BUDGET, bypass_cache=False):
+    # Sends only the tables relevant to the question instead of the full schema, read from the
+    # typed copy when one was built on upload
+    pruned = prune_schema(resolve_database(database_path), question, token_budget)
+    print(f"Schema prompt: {len(pruned['tables'])} tables, ~{pruned['estimated_tokens']} tokens "
+          f"(full schema ~{pruned['full_tokens']})")
+    return generate_sql_via_api(question, pruned["schema"], bypass_cache)
@@ -1,83 +1,216 @@
 import sqlite3
 import json
 import os
+import sys
+import hashlib
 from pathlib import Path
+from instrumentation import request, span, count, annotate
+
+# Introspection results are cached per database file and reused while its fingerprint is unchanged
+CACHE_VERSION = 1
+CACHE_DIR = os.environ.get("RAZORX_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"))
+_memory_cache = {}
+
+# Bookkeeping tables written by ingest.py into the typed copy of an uploaded database
+TYPED_COLUMNS_TABLE = "razorx_typed_columns"
+INGEST_META_TABLE = "razorx_ingest_meta"
+
+def database_fingerprint(database_path):
+    # Cheap identity of the database contents without opening a connection: file size and mtime,
+    # plus the schema cookie (PRAGMA schema_version) and the file change counter from the 100-byte
+    # SQLite header. The change counter is bumped by every committed write from any connection,
+    # which makes it the cross-process equivalent of PRAGMA data_version.
+    stat = os.stat(database_path)
+    with open(database_path, "rb") as f:
+        header = f.read(100)
+    change_counter = int.from_bytes(header[24:28], "big")
+    schema_version = int.from_bytes(header[40:44], "big")
+    parts = [stat.st_size, stat.st_mtime_ns, schema_version, change_counter]
+
+    # WAL commits don't touch the main file header until a checkpoint
+    wal_path = f"{database_path}-wal"
+    if os.path.exists(wal_path):
+        wal_stat = os.stat(wal_path)
+        parts += [wal_stat.st_size, wal_stat.st_mtime_ns]
+
+    return hashlib.sha1(":".join(str(part) for part in parts).encode()).hexdigest()[:16]
+
+def connect_readonly(database_path):
+    # Attempt read-only connection, fallback to normal with query_only
+    try:
+        conn = sqlite3.connect(f"file:{database_path}?mode=ro", uri=True)
+    except sqlite3.OperationalError:
+        conn = sqlite3.connect(database_path)
+        conn.execute("PRAGMA query_only = 1")  # Prevent modifications
+    return conn
+
+def database_key(database_path):
+    # Names the cache files of one database path; their contents carry the fingerprint
+    return hashlib.sha1(os.path.abspath(database_path).encode()).hexdigest()[:12]
+
+def _cache_path(database_path):
+    return os.path.join(CACHE_DIR, f"schema-{database_key(database_path)}.json")
+
+def _load_cache(database_path):
+    cached = _memory_cache.get(os.path.abspath(database_path))
+    if cached is not None:
+        return cached
+    try:
+        with open(_cache_path(database_path), "r") as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if cached.get("version") != CACHE_VERSION:
+        return None
+    return cached
+
+def _save_cache(database_path, cache):
+    _memory_cache[os.path.abspath(database_path)] = cache
+    # Caching is best-effort: stdout carries the schema, so failures stay silent
+    cache_path = _cache_path(database_path)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(tmp_path, "w") as f:
+            json.dump(cache, f)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass
+
+def _introspect_table(cursor, safe_table_name):
+    # Get columns and data types
+    cursor.execute(f'PRAGMA table_info("{safe_table_name}")')
+    columns = cursor.fetchall()
+    column_details = [{"name": col[1], "type": col[2]} for col in columns]
+
+    # Get primary keys
+    primary_keys = [col[1] for col in columns if col[5] == 1]
+
+    # Get foreign key constraints
+    cursor.execute(f'PRAGMA foreign_key_list("{safe_table_name}")')
+    foreign_keys = cursor.fetchall()
+    foreign_key_details = [
+        {"from_column": fk[3], "to_table": fk[2], "to_column": fk[4]}
+        for fk in foreign_keys
+    ]
+    return column_details, primary_keys, foreign_key_details
+
+def _sample_rows(cursor, safe_table_name, column_names):
+    # Fetch sample rows (handle BLOBs and empty results)
+    cursor.execute(f'SELECT * FROM "{safe_table_name}" LIMIT 3')
+    sample_rows = cursor.fetchall()
+    sample_data = []
+
+    for row in sample_rows:
+        row_data = {}
+        for name, value in zip(column_names, row):
+            if isinstance(value, bytes):
+                # Convert BLOB to hexadecimal representation
+                row_data[name] = f"0x{value.hex()}"
+            else:
+                row_data[name] = value
+        sample_data.append(row_data)
+    return sample_data
+
+def load_schema(database_path, use_cache=True):
+    # Returns (schema, serialized_schema, stats). When the database fingerprint matches the cache
+    # nothing is read from the database; when it changed, only tables whose CREATE statement
+    # changed (or that are new) are re-introspected, the rest only get their sample rows refreshed.
+    with span("schema.load", database=os.path.basename(database_path)):
+        schema, serialized, stats = _load_schema(database_path, use_cache)
+        annotate(cache=stats["cache"], tables=stats["tables"], introspected=stats["introspected"])
+        return schema, serialized, stats
+
+def _load_schema(database_path, use_cache):
+    db_path = Path(database_path)
+    if not db_path.is_file():
+        raise FileNotFoundError(f"Database file {database_path} not found")
+
+    with span("schema.fingerprint"):
+        fingerprint = database_fingerprint(database_path)
+    with span("schema.read_cache"):
+        cached = _load_cache(database_path) if use_cache else None
+    if cached and cached["fingerprint"] == fingerprint:
+        stats = {"fingerprint": fingerprint, "cache": "hit", "tables": len(cached["schema"]), "introspected": 0}
+        return cached["schema"], cached["serialized"], stats
+
+    cached_sql = cached["table_sql"] if cached else {}
+    cached_schema = cached["schema"] if cached else {}
+
+    conn = connect_readonly(database_path)
+    try:
+        cursor = conn.cursor()
+
+        # Retrieve table names
+        cursor.execute("SELECT name, sql FROM sqlite_master WHERE type='table';")
+        tables = cursor.fetchall()
+
+        if not tables:
+            raise Exception("No tables found in the database")
+
+        schema = {}
+        table_sql = {}
+        introspected = 0
+
+        for table_name, sql in tables:
+            if table_name in (TYPED_COLUMNS_TABLE, INGEST_META_TABLE):
+                continue
+
+            # Escape table name for SQL queries
+            safe_table_name = table_name.replace('"', '""')
+
+            if table_name in cached_schema and cached_sql.get(table_name) == sql:
+                previous = cached_schema[table_name]
+                column_details = previous["columns"]
+                primary_keys = previous["primary_keys"]
+                foreign_key_details = previous["foreign_keys"]
+            else:
+                column_details, primary_keys, foreign_key_details = _introspect_table(cursor, safe_table_name)
+                introspected += 1
+                count("schema.tables_introspected")
+
+            column_names = [col["name"] for col in column_details]
+            sample_data = _sample_rows(cursor, safe_table_name, column_names)
+            count("schema.tables_sampled")
+
+            # Save schema details
+            schema[table_name] = {
+                "columns": column_details,
+                "primary_keys": primary_keys,
+                "foreign_keys": foreign_key_details,
+                "sample_data": sample_data
+            }
+            table_sql[table_name] = sql
+
+        # Tell the LLM which columns hold values parsed from formatted text
+        if any(name == TYPED_COLUMNS_TABLE for name, _ in tables):
+            cursor.execute(f"SELECT table_name, column_name, source_column, kind FROM {TYPED_COLUMNS_TABLE}")
+            for table_name, column_name, source_column, kind in cursor.fetchall():
+                if table_name in schema:
+                    schema[table_name].setdefault("typed_columns", {})[column_name] = f"{kind} parsed from {source_column}"
+    finally:
+        conn.close()
+
+    serialized = json.dumps(schema, indent=2, default=str)
+    # Round-trip so the cached schema matches what a later cache hit would load from disk
+    schema = json.loads(serialized)
+    if use_cache:
+        with span("schema.save_cache"):
+            _save_cache(database_path, {
+                "version": CACHE_VERSION,
+                "fingerprint": fingerprint,
+                "table_sql": table_sql,
+                "schema": schema,
+                "serialized": serialized,
+            })
+    stats = {"fingerprint": fingerprint, "cache": "refresh" if cached else "miss",
+             "tables": len(schema), "introspected": introspected}
+    return schema, serialized, stats
 
 def get_schema_with_samples(database_path):
     try:
-        # Check if database file exists
-        db_path = Path(database_path)
-        if not db_path.is_file():
-            raise FileNotFoundError(f"Database file {database_path} not found")
-
-        # Attempt read-only connection, fallback to normal with query_only
-        try:
-            conn = sqlite3.connect(f"file:{database_path}?mode=ro", uri=True)
-        except sqlite3.OperationalError:
-            conn = sqlite3.connect(database_path)
-            conn.execute("PRAGMA query_only = 1")  # Prevent modifications
-        
-        try:
-            cursor = conn.cursor()
-
-            # Retrieve table names
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-            tables = cursor.fetchall()
-
-            if not tables:
-                raise Exception("No tables found in the database")
-
-            schema = {}
-
-            for table in tables:
-                table_name = table[0]
-                # Escape table name for SQL queries
-                safe_table_name = table_name.replace('"', '""')
-
-                # Get columns and data types
-                cursor.execute(f'PRAGMA table_info("{safe_table_name}")')
-                columns = cursor.fetchall()
-                column_details = [{"name": col[1], "type": col[2]} for col in columns]
-
-                # Get primary keys
-                primary_keys = [col[1] for col in columns if col[5] == 1]
-
-                # Get foreign key constraints
-                cursor.execute(f'PRAGMA foreign_key_list("{safe_table_name}")')
-                foreign_keys = cursor.fetchall()
-                foreign_key_details = [
-                    {"from_column": fk[3], "to_table": fk[2], "to_column": fk[4]} 
-                    for fk in foreign_keys
-                ]
-
-                # Fetch sample rows (handle BLOBs and empty results)
-                cursor.execute(f'SELECT * FROM "{safe_table_name}" LIMIT 3')
-                sample_rows = cursor.fetchall()
-                sample_data = []
-                column_names = [col[1] for col in columns]
-
-                for row in sample_rows:
-                    row_data = {}
-                    for name, value in zip(column_names, row):
-                        if isinstance(value, bytes):
-                            # Convert BLOB to hexadecimal representation
-                            row_data[name] = f"0x{value.hex()}"
-                        else:
-                            row_data[name] = value
-                    sample_data.append(row_data)
-
-                # Save schema details
-                schema[table_name] = {
-                    "columns": column_details,
-                    "primary_keys": primary_keys,
-                    "foreign_keys": foreign_key_details,
-                    "sample_data": sample_data
-                }
-
-            return json.dumps(schema, indent=2, default=str)
-
-        finally:
-            conn.close()
+        _, serialized, _ = load_schema(database_path)
+        return serialized
 
     except sqlite3.Error as e:
         print(f"Database error: {e}")
@@ -86,9 +219,25 @@ def get_schema_with_samples(database_path):
         print(f"Error: {e}")
         return json.dumps({"error": str(e)})
 
+def warm_schema_cache(database_path):
+    # Called after a database upload so the first /execute finds the cache ready
+    try:
+        _, _, stats = load_schema(database_path)
+        return stats
+    except Exception as e:
+        return {"error": str(e)}
+
 # For testing
 if __name__ == "__main__":
-    DATABASE_PATH = 'database.db'
-    schema_json = get_schema_with_samples(DATABASE_PATH)
+    if "--warm" in sys.argv[1:]:
+        args = [arg for arg in sys.argv[1:] if arg != "--warm"]
+        with request("get_schema", warm=True):
+            stats = warm_schema_cache(args[0] if args else "database.db")
+        print(json.dumps(stats))
+        sys.exit(0)
+
+    DATABASE_PATH = sys.argv[1] if len(sys.argv) > 1 else 'database.db'
+    with request("get_schema"):
+        schema_json = get_schema_with_samples(DATABASE_PATH)
     if schema_json:
-        print("Database Schema with Sample Data:\n", schema_json)
\ No newline at end of file
+        print("Database Schema with Sample Data:\n", schema_json)
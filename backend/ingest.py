@@ -0,0 +1,247 @@
+import os
+import re
+import sys
+import json
+import time
+import sqlite3
+from datetime import datetime
+from instrumentation import request, span, count
+from get_schema import (TYPED_COLUMNS_TABLE, INGEST_META_TABLE, connect_readonly,
+                        database_fingerprint, warm_schema_cache)
+
+# Uploaded databases often keep numbers as formatted text (" $1,618.50 ", "(12.00)", "45%") and
+# dates as "01/06/2014", which forces every generated query to CAST(REPLACE(SUBSTR(...))) per
+# row. On upload we build a derived copy, <name>.typed.db, where such columns get a typed,
+# indexed companion column ("Units Sold_value" REAL, "Date_date" ISO TEXT). The original
+# columns stay untouched so existing queries keep working.
+SAMPLE_SIZE = 200
+MATCH_THRESHOLD = 0.9
+CURRENCY_SYMBOLS = "$€£₹¥"
+DATE_FORMATS = [
+    "%m/%d/%Y", "%d/%m/%Y", "%m/%d/%y", "%d/%m/%y", "%d-%m-%Y", "%m-%d-%Y", "%Y/%m/%d",
+    "%d-%b-%Y", "%d %b %Y", "%b %d, %Y", "%d %B %Y", "%B %d, %Y",
+    "%m/%d/%Y %H:%M", "%m/%d/%Y %H:%M:%S", "%d/%m/%Y %H:%M", "%d/%m/%Y %H:%M:%S",
+]
+_DIGITS_RE = re.compile(r"^(\d+(\.\d+)?|\.\d+)$")
+_GROUPED_RE = re.compile(r"^\d{1,3}(,\d{3})+(\.\d+)?$")
+
+def typed_database_path(database_path):
+    return os.path.splitext(database_path)[0] + ".typed.db"
+
+def parse_number(text):
+    # Returns the numeric value of a formatted number, or None if text isn't one.
+    # Handles currency symbols, thousands separators, percentages, "-" and "(...)" negatives,
+    # and the accounting "$-" for zero.
+    if not isinstance(text, str):
+        return text if isinstance(text, (int, float)) else None
+    s = text.strip()
+    if not s:
+        return None
+    negative = False
+    if s.startswith("-"):
+        negative, s = True, s[1:].strip()
+    symbol = bool(s) and s[0] in CURRENCY_SYMBOLS
+    if symbol:
+        s = s[1:].strip()
+    if s.startswith("(") and s.endswith(")"):
+        negative, s = not negative, s[1:-1].strip()
+    if s.startswith("-"):
+        negative, s = not negative, s[1:].strip()
+    if symbol and s in ("", "-"):
+        return 0.0
+    percent = s.endswith("%")
+    if percent:
+        s = s[:-1].strip()
+    if "," in s:
+        # Only well-formed thousands groups; "1.234,56" (decimal comma) and "1,2,3" (a list) are
+        # ambiguous and rejected rather than read as 1.23456 and 123
+        if not _GROUPED_RE.match(s):
+            return None
+        s = s.replace(",", "")
+    if not _DIGITS_RE.match(s):
+        return None
+    value = float(s) / (100 if percent else 1)
+    return -value if negative else value
+
+def parse_date(text, date_format):
+    # ISO "YYYY-MM-DD" (or with time) so SQLite's date functions and ORDER BY work on it
+    if not isinstance(text, str):
+        return None
+    try:
+        parsed = datetime.strptime(text.strip(), date_format)
+    except ValueError:
+        return None
+    if parsed.hour or parsed.minute or parsed.second:
+        return parsed.strftime("%Y-%m-%d %H:%M:%S")
+    return parsed.strftime("%Y-%m-%d")
+
+def _is_formatted_number(text):
+    s = text.strip()
+    return any(ch in s for ch in CURRENCY_SYMBOLS + ",%().") or s.startswith("-")
+
+def detect_column(values):
+    # Decides from sampled text values whether a column holds numbers or dates.
+    # Returns {"kind": "number"|"currency"|"percent"|"date", "format": ...} or None.
+    values = [value for value in values if isinstance(value, str) and value.strip()]
+    if not values:
+        return None
+
+    parsed = [parse_number(value) for value in values]
+    matched = [value for value, number in zip(values, parsed) if number is not None]
+    if len(matched) >= MATCH_THRESHOLD * len(values):
+        if any(_is_formatted_number(value) for value in matched):
+            if any(symbol in value for value in matched for symbol in CURRENCY_SYMBOLS):
+                kind = "currency"
+            elif any(value.strip().endswith("%") for value in matched):
+                kind = "percent"
+            else:
+                kind = "number"
+            return {"kind": kind, "format": None}
+        # Plain digit strings are as often identifiers (phone numbers, codes, PINs) as quantities,
+        # and a bare CAST already handles them
+        return None
+
+    for date_format in DATE_FORMATS:
+        dates = [parse_date(value, date_format) for value in values]
+        if sum(date is not None for date in dates) >= MATCH_THRESHOLD * len(values):
+            return {"kind": "date", "format": date_format}
+    return None
+
+def _unique_name(base, existing):
+    name = base
+    suffix = 2
+    while name.lower() in existing:
+        name = f"{base}{suffix}"
+        suffix += 1
+    existing.add(name.lower())
+    return name
+
+def _typed_column_name(column, kind, existing):
+    return _unique_name(f"{column}_date" if kind == "date" else f"{column}_value", existing)
+
+def _quote(identifier):
+    return '"' + identifier.replace('"', '""') + '"'
+
+def build_typed_database(database_path, sample_size=SAMPLE_SIZE):
+    # Builds <name>.typed.db next to the database and returns (typed_path, typed_columns, skipped)
+    typed_path = typed_database_path(database_path)
+    tmp_path = f"{typed_path}.{os.getpid()}.tmp"
+    try:
+        typed_columns, skipped = _build(database_path, tmp_path, sample_size)
+        os.replace(tmp_path, typed_path)
+    except BaseException:
+        # A half-built copy must not be left next to the database
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return typed_path, typed_columns, skipped
+
+def _build(database_path, tmp_path, sample_size):
+    source_fingerprint = database_fingerprint(database_path)
+    source = connect_readonly(database_path)
+    # Autocommit mode: the ALTER/UPDATE/INDEX of a table are committed or rolled back together
+    # by the explicit BEGIN below, instead of the module committing before the ALTER
+    target = sqlite3.connect(tmp_path, isolation_level=None)
+    try:
+        source.backup(target)
+    finally:
+        source.close()
+
+    target.create_function("razorx_parse_number", 1, parse_number, deterministic=True)
+    target.create_function("razorx_parse_date", 2, parse_date, deterministic=True)
+    typed_columns = []
+    skipped = []
+    try:
+        tables = [row[0] for row in target.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'")]
+        index_names = {row[0].lower() for row in target.execute("SELECT name FROM sqlite_master WHERE type='index'")}
+        for table in tables:
+            columns = target.execute(f"PRAGMA table_info({_quote(table)})").fetchall()
+            existing = {column[1].lower() for column in columns}
+            additions = []
+            for column in columns:
+                name = column[1]
+                # Only text values need parsing; sample them rather than scanning the table
+                values = [row[0] for row in target.execute(
+                    f"SELECT {_quote(name)} FROM {_quote(table)} WHERE typeof({_quote(name)}) = 'text' LIMIT ?",
+                    (sample_size,))]
+                detected = detect_column(values)
+                if detected:
+                    additions.append((name, _typed_column_name(name, detected["kind"], existing), detected))
+
+            if not additions:
+                continue
+            target.execute("BEGIN")
+            try:
+                assignments = []
+                for source_column, typed_column, detected in additions:
+                    column_type = "TEXT" if detected["kind"] == "date" else "REAL"
+                    target.execute(f"ALTER TABLE {_quote(table)} ADD COLUMN {_quote(typed_column)} {column_type}")
+                    if detected["kind"] == "date":
+                        expression = f"razorx_parse_date({_quote(source_column)}, ?)"
+                    else:
+                        expression = f"razorx_parse_number({_quote(source_column)})"
+                    assignments.append((f"{_quote(typed_column)} = {expression}", detected["format"]))
+                # One pass over the table fills every typed column
+                parameters = [date_format for _, date_format in assignments if date_format is not None]
+                target.execute(f"UPDATE {_quote(table)} SET {', '.join(sql for sql, _ in assignments)}", parameters)
+                for _, typed_column, _ in additions:
+                    # "idx_a_b_c" is both table "a_b" + column "c" and table "a" + column "b_c"
+                    index_name = _unique_name(f"idx_{table}_{typed_column}", index_names)
+                    target.execute(f"CREATE INDEX {_quote(index_name)} ON {_quote(table)}({_quote(typed_column)})")
+                target.execute("COMMIT")
+            except sqlite3.Error as e:
+                # Virtual or otherwise unalterable tables keep only their original columns
+                target.execute("ROLLBACK")
+                skipped.append({"table": table, "error": str(e)})
+                continue
+            # Listed only once committed, so the schema never points at an empty column
+            typed_columns.extend({"table": table, "column": typed_column, "source_column": source_column,
+                                  "kind": detected["kind"], "format": detected["format"]}
+                                 for source_column, typed_column, detected in additions)
+
+        target.execute("BEGIN")
+        target.execute(f"CREATE TABLE {TYPED_COLUMNS_TABLE} (table_name TEXT, column_name TEXT, source_column TEXT, kind TEXT, format TEXT)")
+        target.executemany(f"INSERT INTO {TYPED_COLUMNS_TABLE} VALUES (?, ?, ?, ?, ?)", [
+            (c["table"], c["column"], c["source_column"], c["kind"], c["format"]) for c in typed_columns])
+        target.execute(f"CREATE TABLE {INGEST_META_TABLE} (key TEXT PRIMARY KEY, value TEXT)")
+        target.executemany(f"INSERT INTO {INGEST_META_TABLE} VALUES (?, ?)", [
+            ("source_fingerprint", source_fingerprint), ("created_at", str(time.time()))])
+        target.execute("COMMIT")
+        target.execute("ANALYZE")
+    finally:
+        target.close()
+    return typed_columns, skipped
+
+def resolve_database(database_path):
+    # The typed copy when it was built from the current database file, otherwise the database itself
+    typed_path = typed_database_path(database_path)
+    if not os.path.exists(typed_path):
+        return database_path
+    try:
+        conn = connect_readonly(typed_path)
+        try:
+            row = conn.execute(f"SELECT value FROM {INGEST_META_TABLE} WHERE key = 'source_fingerprint'").fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return database_path
+    if row and row[0] == database_fingerprint(database_path):
+        return typed_path
+    return database_path
+
+if __name__ == "__main__":
+    # Run after a database upload: build the typed copy, then warm its schema cache
+    DATABASE_PATH = sys.argv[1] if len(sys.argv) > 1 else "database.db"
+    try:
+        start = time.perf_counter()
+        with request("ingest"):
+            with span("ingest.build_typed_database"):
+                typed_path, typed_columns, skipped = build_typed_database(DATABASE_PATH)
+            count("ingest.typed_columns", len(typed_columns))
+            stats = warm_schema_cache(typed_path)
+        print(json.dumps({"typed_database": typed_path, "typed_columns": typed_columns, "skipped": skipped,
+                          "seconds": round(time.perf_counter() - start, 3), "schema_cache": stats}))
+    except Exception as e:
+        print(json.dumps({"error": str(e)}))
+        sys.exit(1)
@@ -0,0 +1,202 @@
+import os
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Structured timing for the Python scripts. A script wraps its work in request(), stages inside it
+# in span() (nested spans become children), and count() adds to counters. When the request ends,
+# one JSON trace goes to RAZORX_TRACE, never to stdout/stderr, which server.js reads:
+#   RAZORX_TRACE=fd:3                 write to an already open file descriptor
+#   RAZORX_TRACE=/var/log/trace.jsonl append one JSON line per request
+# RAZORX_PROFILE=<directory> also runs cProfile over each request and dumps the stats there
+# (<name>-<time>-<pid>.prof, readable with pstats or snakeviz, plus a .txt summary).
+# server.js sets RAZORX_REQUEST_ID for every script one HTTP request runs, so their traces can be
+# joined into the stages of that request.
+# Without an active request every call here is a no-op, so library code can be instrumented freely.
+TRACE_TARGET = os.environ.get("RAZORX_TRACE", "")
+REQUEST_ID = os.environ.get("RAZORX_REQUEST_ID", "")
+PROFILE_DIR = os.environ.get("RAZORX_PROFILE", "")
+PROFILE_TOP = 40  # Functions listed in the .txt summary
+
+_local = threading.local()
+_lock = threading.Lock()
+_root = None
+
+def rss_mb():
+    # Current resident set size, Linux only
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return round(int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024, 1)
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+def maxrss_mb(usage):
+    # ru_maxrss of a getrusage()/wait4() result in MB; it is in KiB on Linux and bytes on macOS
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return round(usage.ru_maxrss / divisor, 1)
+
+def peak_rss_mb(who="self"):
+    # Peak resident set size of this process, or with who="children" of its largest waited-for child
+    if resource is None:
+        return None
+    return maxrss_mb(resource.getrusage(resource.RUSAGE_SELF if who == "self" else resource.RUSAGE_CHILDREN))
+
+class Span:
+    def __init__(self, name, attributes, start):
+        self.name = name
+        self.attributes = dict(attributes)
+        self.start = start
+        self.seconds = None
+        self.counters = {}
+        self.children = []
+        self.rss_mb = None
+        self.peak_rss_mb = None
+
+    def finish(self):
+        self.seconds = time.perf_counter() - self.start
+        self.rss_mb = rss_mb()
+        self.peak_rss_mb = peak_rss_mb()
+
+    def to_dict(self, origin):
+        entry = {"name": self.name, "start": round(self.start - origin, 6), "seconds": round(self.seconds or 0.0, 6)}
+        if self.attributes:
+            entry["attributes"] = self.attributes
+        if self.counters:
+            entry["counters"] = self.counters
+        if self.rss_mb is not None:
+            entry["rss_mb"] = self.rss_mb
+        if self.peak_rss_mb is not None:
+            entry["peak_rss_mb"] = self.peak_rss_mb
+        if self.children:
+            entry["children"] = [child.to_dict(origin) for child in self.children]
+        return entry
+
+def _stack():
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+def _current():
+    # Innermost open span of this thread; spans opened in other threads attach to the request
+    stack = _stack()
+    return stack[-1] if stack else _root
+
+@contextmanager
+def span(name, **attributes):
+    parent = _current()
+    if parent is None:
+        yield None
+        return
+    current = Span(name, attributes, time.perf_counter())
+    with _lock:
+        parent.children.append(current)
+    stack = _stack()
+    stack.append(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.attributes["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current.finish()
+        stack.pop()
+
+def add_span(name, seconds, **attributes):
+    # Records a stage that was timed elsewhere, e.g. in a worker process
+    parent = _current()
+    if parent is None:
+        return
+    now = time.perf_counter()
+    completed = Span(name, attributes, now - (seconds or 0.0))
+    completed.seconds = seconds or 0.0
+    with _lock:
+        parent.children.append(completed)
+
+def count(name, value=1):
+    current = _current()
+    if current is None:
+        return
+    with _lock:
+        current.counters[name] = current.counters.get(name, 0) + value
+        if current is not _root:
+            _root.counters[name] = _root.counters.get(name, 0) + value
+
+def annotate(**attributes):
+    current = _current()
+    if current is not None:
+        with _lock:
+            current.attributes.update(attributes)
+
+def _emit(trace):
+    # Best effort: a missing descriptor or unwritable file must never break the script itself
+    data = (json.dumps(trace, default=str) + "\n").encode("utf-8")
+    try:
+        if TRACE_TARGET.startswith("fd:"):
+            os.write(int(TRACE_TARGET[3:]), data)
+        else:
+            directory = os.path.dirname(os.path.abspath(TRACE_TARGET))
+            os.makedirs(directory, exist_ok=True)
+            with open(TRACE_TARGET, "ab") as f:
+                f.write(data)
+    except (OSError, ValueError):
+        pass
+
+def _dump_profile(profiler, name):
+    import pstats
+    import io
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        base = os.path.join(PROFILE_DIR, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}")
+        profiler.dump_stats(f"{base}.prof")
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(PROFILE_TOP)
+        with open(f"{base}.txt", "w", encoding="utf-8") as f:
+            f.write(summary.getvalue())
+        return f"{base}.prof"
+    except OSError:
+        return None
+
+@contextmanager
+def request(name, **attributes):
+    # One traced unit of work: a script run, or one job of a long-lived worker
+    global _root
+    if _root is not None:
+        # Already inside a request (a script calling another script's main), nest instead
+        with span(name, **attributes) as current:
+            yield current
+        return
+
+    profiler = None
+    if PROFILE_DIR:
+        import cProfile
+        profiler = cProfile.Profile()
+    started_at = time.time()
+    _root = Span(name, attributes, time.perf_counter())
+    _local.stack = []
+    if profiler:
+        profiler.enable()
+    try:
+        yield _root
+    except BaseException as e:
+        _root.attributes["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        if profiler:
+            profiler.disable()
+        root, _root = _root, None
+        root.finish()
+        trace = {"trace": name, "pid": os.getpid(), "started_at": round(started_at, 3), **root.to_dict(root.start)}
+        if REQUEST_ID:
+            trace["request_id"] = REQUEST_ID
+        if profiler:
+            trace["profile"] = _dump_profile(profiler, name)
+        if TRACE_TARGET:
+            _emit(trace)
@@ -0,0 +1,154 @@
+import os
+import re
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+from get_schema import CACHE_DIR
+
+# Disk-backed cache of LLM responses, keyed by (normalized question, schema fingerprint, model,
+# prompt version) within a namespace. Generated prompts that embed data are keyed on their exact
+# text instead (normalize=False). Entries expire after a TTL and the least recently used ones are
+# evicted above MAX_ENTRIES. A bypassed lookup skips the cached answer but the fresh one still
+# replaces it; set LLM_CACHE_BYPASS=1 to skip the cache entirely.
+CACHE_PATH = os.environ.get("LLM_CACHE_PATH", os.path.join(CACHE_DIR, "llm_cache.db"))
+DEFAULT_TTL = float(os.environ.get("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", "2000"))
+
+def bypass_requested():
+    return os.environ.get("LLM_CACHE_BYPASS", "").lower() in ("1", "true", "yes")
+
+def normalize_question(question):
+    # Case, whitespace and trailing punctuation don't change what is being asked
+    return re.sub(r"\s+", " ", question).strip().rstrip("?.!").strip().lower()
+
+def cache_key(namespace, question, fingerprint, model, prompt_version, normalize=True):
+    parts = [namespace, normalize_question(question) if normalize else question, fingerprint or "", model,
+             str(prompt_version)]
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+def _connect(path=None):
+    path = path or CACHE_PATH
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")  # Concurrent report processes read while one writes
+    conn.execute("""CREATE TABLE IF NOT EXISTS entries (
+        key TEXT PRIMARY KEY,
+        namespace TEXT NOT NULL,
+        value TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        last_access REAL NOT NULL,
+        hits INTEGER NOT NULL DEFAULT 0
+    )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries(last_access)")
+    conn.execute("""CREATE TABLE IF NOT EXISTS stats (
+        namespace TEXT PRIMARY KEY,
+        hits INTEGER NOT NULL DEFAULT 0,
+        misses INTEGER NOT NULL DEFAULT 0,
+        bypasses INTEGER NOT NULL DEFAULT 0
+    )""")
+    return conn
+
+def _count(conn, namespace, column):
+    conn.execute("INSERT OR IGNORE INTO stats(namespace) VALUES (?)", (namespace,))
+    conn.execute(f"UPDATE stats SET {column} = {column} + 1 WHERE namespace = ?", (namespace,))
+
+def get(namespace, question, fingerprint, model, prompt_version, ttl=DEFAULT_TTL, bypass=False, normalize=True,
+        path=None):
+    # Returns (hit, value); value is the JSON-decoded cached response
+    conn = _connect(path)
+    try:
+        with conn:
+            if bypass or bypass_requested():
+                _count(conn, namespace, "bypasses")
+                return False, None
+
+            key = cache_key(namespace, question, fingerprint, model, prompt_version, normalize)
+            now = time.time()
+            row = conn.execute("SELECT value, created_at FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > ttl:
+                _count(conn, namespace, "misses")
+                return False, None
+
+            conn.execute("UPDATE entries SET last_access = ?, hits = hits + 1 WHERE key = ?", (now, key))
+            _count(conn, namespace, "hits")
+            return True, json.loads(row[0])
+    finally:
+        conn.close()
+
+def put(namespace, question, fingerprint, model, prompt_version, value,
+        ttl=DEFAULT_TTL, max_entries=MAX_ENTRIES, normalize=True, path=None):
+    if bypass_requested():
+        return
+    conn = _connect(path)
+    try:
+        with conn:
+            key = cache_key(namespace, question, fingerprint, model, prompt_version, normalize)
+            now = time.time()
+            conn.execute(
+                "INSERT OR REPLACE INTO entries(key, namespace, value, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, namespace, json.dumps(value), now, now),
+            )
+            # Expire by TTL, then evict least recently used entries beyond the size bound
+            conn.execute("DELETE FROM entries WHERE created_at < ?", (now - ttl,))
+            conn.execute(
+                "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (max_entries,),
+            )
+    finally:
+        conn.close()
+
+def cached_call(namespace, question, fingerprint, model, prompt_version, compute, bypass=False, should_cache=None,
+                normalize=True):
+    # Returns compute() through the cache. should_cache(value) can veto storing a result
+    # (e.g. an error message) so failures are retried on the next request.
+    hit, value = get(namespace, question, fingerprint, model, prompt_version, bypass=bypass, normalize=normalize)
+    if hit:
+        return value
+    value = compute()
+    if should_cache is None or should_cache(value):
+        put(namespace, question, fingerprint, model, prompt_version, value, normalize=normalize)
+    return value
+
+def stats(path=None):
+    conn = _connect(path)
+    try:
+        result = {}
+        for namespace, hits, misses, bypasses in conn.execute("SELECT namespace, hits, misses, bypasses FROM stats"):
+            lookups = hits + misses
+            result[namespace] = {
+                "hits": hits,
+                "misses": misses,
+                "bypasses": bypasses,
+                "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+            }
+        entries = conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        return {"entries": entries, "namespaces": result}
+    finally:
+        conn.close()
+
+# Command line access for server.js:
+#   python llm_cache.py get [--bypass] <namespace> <model> <prompt_version> <fingerprint> <question>
+#   python llm_cache.py put <namespace> <model> <prompt_version> <fingerprint> <question>   (JSON value on stdin)
+#   python llm_cache.py stats
+# get --bypass only counts the lookup as a bypass and reports a miss
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    arguments = sys.argv[2:]
+    bypass = command == "get" and arguments[:1] == ["--bypass"]
+    if bypass:
+        arguments = arguments[1:]
+    if command == "stats":
+        print(json.dumps(stats()))
+    elif command in ("get", "put") and len(arguments) == 5:
+        namespace, model, prompt_version, fingerprint, question = arguments
+        if command == "get":
+            hit, value = get(namespace, question, fingerprint, model, prompt_version, bypass=bypass)
+            print(json.dumps({"hit": hit, "value": value}))
+        else:
+            put(namespace, question, fingerprint, model, prompt_version, json.load(sys.stdin))
+            print(json.dumps({"stored": not bypass_requested()}))
+    else:
+        print("Usage: python llm_cache.py get [--bypass]|put <namespace> <model> <prompt_version> <fingerprint> <question> | stats")
+        sys.exit(1)
@@ -0,0 +1,223 @@
+import os
+import time
+import random
+import sqlite3
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from get_schema import CACHE_DIR
+from schema_index import estimate_tokens
+
+# Shared client for the chat-completions backends: one pooled keep-alive session, a token bucket
+# that queues requests instead of exceeding the tokens-per-minute quota (see ISSUES.txt), and
+# jittered retries on 429/5xx.
+TOKENS_PER_MINUTE = int(os.environ.get("LLM_TOKENS_PER_MINUTE", "6000"))
+BUCKET_STATE_PATH = os.environ.get("LLM_BUCKET_PATH", os.path.join(CACHE_DIR, "llm_bucket.db"))
+MAX_RETRIES = 4
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 30.0
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Completion tokens reserved when the caller sets no max_tokens; the quota counts completions too.
+# The reservation is settled against the response's reported usage.
+DEFAULT_COMPLETION_TOKENS = int(os.environ.get("LLM_DEFAULT_COMPLETION_TOKENS", "1024"))
+
+class RateLimitTimeout(Exception):
+    pass
+
+class TokenBucket:
+    # Token bucket refilled continuously at tokens_per_minute / 60 per second. With state_path the
+    # bucket lives in a small SQLite file, so every process sharing the API key shares the quota.
+    def __init__(self, tokens_per_minute=TOKENS_PER_MINUTE, state_path=None):
+        self.capacity = float(tokens_per_minute)
+        self.rate = self.capacity / 60.0
+        self.state_path = state_path
+        self._lock = threading.Lock()
+        self._tokens = self.capacity
+        self._updated = time.time()
+        self._waiting = 0
+        self._metrics = {"acquired": 0, "waited": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0, "max_queue_depth": 0}
+        if state_path:
+            conn = self._connect()
+            with conn:
+                conn.execute("CREATE TABLE IF NOT EXISTS bucket (id INTEGER PRIMARY KEY CHECK (id = 1), tokens REAL, updated REAL)")
+                conn.execute("INSERT OR IGNORE INTO bucket VALUES (1, ?, ?)", (self.capacity, time.time()))
+            conn.close()
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.state_path)), exist_ok=True)
+        return sqlite3.connect(self.state_path, timeout=30, isolation_level=None)
+
+    def _try_take(self, tokens):
+        # Returns 0 if the tokens were taken, otherwise the seconds until they will be available
+        now = time.time()
+        if not self.state_path:
+            with self._lock:
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return 0.0
+                return (tokens - self._tokens) / self.rate
+
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")  # Serializes bucket updates across processes
+            available, updated = conn.execute("SELECT tokens, updated FROM bucket WHERE id = 1").fetchone()
+            available = min(self.capacity, available + max(now - updated, 0) * self.rate)
+            wait = 0.0
+            if available >= tokens:
+                available -= tokens
+            else:
+                wait = (tokens - available) / self.rate
+            conn.execute("UPDATE bucket SET tokens = ?, updated = ? WHERE id = 1", (available, now))
+            conn.execute("COMMIT")
+            return wait
+        finally:
+            conn.close()
+
+    def acquire(self, tokens, timeout=None):
+        # Blocks until the tokens are available. A request larger than the whole bucket would
+        # never fit, so it is clamped to the capacity and waits for a full bucket instead.
+        tokens = min(float(tokens), self.capacity)
+        start = time.monotonic()
+        with self._lock:
+            self._waiting += 1
+            self._metrics["max_queue_depth"] = max(self._metrics["max_queue_depth"], self._waiting)
+        try:
+            while True:
+                wait = self._try_take(tokens)
+                if wait <= 0:
+                    break
+                if timeout is not None and time.monotonic() - start + wait > timeout:
+                    raise RateLimitTimeout(f"Waiting for {tokens:.0f} tokens would exceed {timeout}s")
+                # Small jitter so queued requests don't all wake at the same instant
+                time.sleep(wait + random.uniform(0, 0.05))
+        finally:
+            waited = time.monotonic() - start
+            with self._lock:
+                self._waiting -= 1
+                self._metrics["acquired"] += 1
+                if waited > 0.01:
+                    self._metrics["waited"] += 1
+                self._metrics["wait_seconds"] += waited
+                self._metrics["max_wait_seconds"] = max(self._metrics["max_wait_seconds"], waited)
+        return waited
+
+    def refund(self, tokens):
+        # Gives back tokens reserved for a request that was never accepted by the API
+        if not self.state_path:
+            with self._lock:
+                self._tokens = min(self.capacity, self._tokens + tokens)
+            return
+        conn = self._connect()
+        try:
+            conn.execute("UPDATE bucket SET tokens = MIN(?, tokens + ?) WHERE id = 1", (self.capacity, tokens))
+        finally:
+            conn.close()
+
+    def metrics(self):
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics["queue_depth"] = self._waiting
+        acquired = metrics["acquired"]
+        metrics["average_wait_seconds"] = metrics["wait_seconds"] / acquired if acquired else 0.0
+        return metrics
+
+class LLMClient:
+    def __init__(self, url, api_key, bucket=None, max_retries=MAX_RETRIES, timeout=60, pool_size=10):
+        self.url = url
+        self.bucket = bucket or TokenBucket()
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.session = requests.Session()
+        # Keep-alive connections are reused across requests; retries are handled below so the
+        # token bucket sees every attempt
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json",
+        })
+        self._lock = threading.Lock()
+        self._metrics = {"requests": 0, "retries": 0, "rate_limited": 0, "failures": 0}
+
+    def estimate_request_tokens(self, payload):
+        # Prompt tokens plus the completion budget: max_tokens, else DEFAULT_COMPLETION_TOKENS
+        prompt_tokens = sum(estimate_tokens(message.get("content", "")) for message in payload.get("messages", []))
+        return prompt_tokens + int(payload.get("max_tokens") or DEFAULT_COMPLETION_TOKENS)
+
+    def _settle(self, reserved, response):
+        # Refunds the part of the reservation the response's usage shows was not spent
+        try:
+            usage = response.json().get("usage") or {}
+            used = usage.get("total_tokens") or (usage["prompt_tokens"] + usage["completion_tokens"])
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return
+        if used < reserved:
+            self.bucket.refund(reserved - used)
+
+    def _count(self, name):
+        with self._lock:
+            self._metrics[name] += 1
+
+    def _retry_delay(self, attempt, response):
+        # Honour Retry-After when the server sends one, otherwise full-jitter exponential backoff
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after:
+                try:
+                    return float(retry_after) + random.uniform(0, 0.25)
+                except ValueError:
+                    pass
+        return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+    def chat(self, payload, queue_timeout=None):
+        # Sends a chat-completions request and returns the requests.Response of the final attempt.
+        # Raises requests.exceptions.RequestException if every attempt failed to connect.
+        # acquire() clamps to the bucket capacity, so that is what is actually reserved
+        tokens = min(self.estimate_request_tokens(payload), self.bucket.capacity)
+        self._count("requests")
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire(tokens, timeout=queue_timeout)
+            response = None
+            try:
+                response = self.session.post(self.url, json=payload, timeout=self.timeout)
+            except requests.exceptions.RequestException:
+                self.bucket.refund(tokens)
+                if attempt == self.max_retries:
+                    self._count("failures")
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    if response.ok:
+                        self._settle(tokens, response)
+                    return response
+                # Neither a 429 nor a 5xx consumed quota; the retry waits for Retry-After or backoff
+                if response.status_code == 429:
+                    self._count("rate_limited")
+                self.bucket.refund(tokens)
+                if attempt == self.max_retries:
+                    self._count("failures")
+                    return response
+            self._count("retries")
+            time.sleep(self._retry_delay(attempt, response))
+
+    def metrics(self):
+        with self._lock:
+            metrics = dict(self._metrics)
+        metrics["bucket"] = self.bucket.metrics()
+        return metrics
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_client(url, api_key):
+    # One client (and session pool) per endpoint and key for the whole process; the token
+    # bucket state is shared across processes through BUCKET_STATE_PATH
+    with _clients_lock:
+        client = _clients.get((url, api_key))
+        if client is None:
+            client = LLMClient(url, api_key, TokenBucket(TOKENS_PER_MINUTE, BUCKET_STATE_PATH))
+            _clients[(url, api_key)] = client
+        return client
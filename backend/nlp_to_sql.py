@@ -1,31 +1,107 @@
-from transformers import T5ForConditionalGeneration, T5Tokenizer
 import os
+import sys
+import threading
+from functools import lru_cache
 
 # Disable warning related to symlinks for Windows
 os.environ["HF_HUB_DISABLE_SYMLINKS_WARNING"] = "1"
 
-# Load pre-trained T5 model and tokenizer
+# Offline fallback for when the hosted LLM quota runs out. The model is loaded on first use, not
+# at import, and questions are translated in padded batches. T5_QUANTIZE=1 swaps the Linear layers
+# for dynamically quantized int8 ones and T5_NUM_BEAMS=1 switches from beam search to greedy
+# decoding; both trade a little accuracy for a lot of CPU time (see bench_nlp_to_sql.py).
 model_name = "t5-small"  # You can try 't5-base' or 't5-large' for better accuracy
-model = T5ForConditionalGeneration.from_pretrained(model_name)
-tokenizer = T5Tokenizer.from_pretrained(model_name, legacy=False)
+PREFIX = "translate English to SQL: "
+MAX_LENGTH = 50
+NUM_BEAMS = int(os.environ.get("T5_NUM_BEAMS", "5"))
+QUANTIZE = os.environ.get("T5_QUANTIZE", "").lower() in ("1", "true", "yes")
+BATCH_SIZE = int(os.environ.get("T5_BATCH_SIZE", "8"))
+THREADS = int(os.environ.get("T5_THREADS", "0"))  # 0 keeps torch's default
+ENCODING_CACHE_SIZE = 1024
 
-def convert_text_to_sql(transcription):
-    # Prepend 'translate English to SQL: ' to instruct the model to generate SQL
-    input_text = "translate English to SQL: " + transcription
+_models = {}
+_models_lock = threading.Lock()
 
-    # Tokenize the input text
-    inputs = tokenizer.encode(input_text, return_tensors="pt")
+@lru_cache(maxsize=1)
+def get_tokenizer():
+    from transformers import T5Tokenizer
+    return T5Tokenizer.from_pretrained(model_name, legacy=False)
 
-    # Generate the SQL query using the model
-    outputs = model.generate(inputs, max_length=50, num_beams=5, early_stopping=True)
+def get_model(quantize=QUANTIZE):
+    # Loaded once per process for each quantize setting
+    with _models_lock:
+        if quantize not in _models:
+            import torch
+            from transformers import T5ForConditionalGeneration
 
-    # Decode and return the SQL query
-    sql_query = tokenizer.decode(outputs[0], skip_special_tokens=True)
-    return sql_query
+            if THREADS:
+                torch.set_num_threads(THREADS)
+            model = T5ForConditionalGeneration.from_pretrained(model_name)
+            model.eval()
+            if quantize:
+                # int8 weights for every Linear layer, activations quantized on the fly
+                model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+            _models[quantize] = model
+        return _models[quantize]
 
-if __name__ == "__main__":
-    # Example: Pass the transcription text from the frontend or backend
-    transcription_text = "What are the total sales for the last quarter?"
-    sql_query = convert_text_to_sql(transcription_text)
+@lru_cache(maxsize=1)
+def _prefix_ids():
+    # The instruction prefix is identical for every question, so it is tokenized once
+    return tuple(get_tokenizer().encode(PREFIX.strip(), add_special_tokens=False))
+
+@lru_cache(maxsize=ENCODING_CACHE_SIZE)
+def encode_question(question):
+    # Token ids for one question: cached prefix ids + question ids + </s>. Repeated questions
+    # (retries, the same question asked again) skip sentencepiece entirely.
+    tokenizer = get_tokenizer()
+    ids = tokenizer.encode(question.strip(), add_special_tokens=False)
+    return _prefix_ids() + tuple(ids) + (tokenizer.eos_token_id,)
+
+def _pad_batch(encoded, pad_token_id):
+    import torch
+
+    width = max(len(ids) for ids in encoded)
+    input_ids = torch.full((len(encoded), width), pad_token_id, dtype=torch.long)
+    attention_mask = torch.zeros((len(encoded), width), dtype=torch.long)
+    for row, ids in enumerate(encoded):
+        input_ids[row, :len(ids)] = torch.tensor(ids, dtype=torch.long)
+        attention_mask[row, :len(ids)] = 1
+    return input_ids, attention_mask
+
+def convert_texts_to_sql(transcriptions, num_beams=NUM_BEAMS, batch_size=BATCH_SIZE, quantize=QUANTIZE):
+    # Returns one SQL string per transcription, in the same order
+    import torch
 
-    print("Generated SQL Query:", sql_query)
+    model = get_model(quantize)
+    tokenizer = get_tokenizer()
+    encoded = [encode_question(text) for text in transcriptions]
+    # Batching questions of similar length keeps the padding (wasted compute) small
+    order = sorted(range(len(encoded)), key=lambda i: len(encoded[i]))
+    results = [None] * len(encoded)
+
+    for start in range(0, len(order), batch_size):
+        batch = order[start:start + batch_size]
+        input_ids, attention_mask = _pad_batch([encoded[i] for i in batch], tokenizer.pad_token_id)
+        with torch.inference_mode():
+            outputs = model.generate(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                max_length=MAX_LENGTH,
+                num_beams=num_beams,
+                do_sample=False,
+                early_stopping=num_beams > 1,
+            )
+        for i, sql_query in zip(batch, tokenizer.batch_decode(outputs, skip_special_tokens=True)):
+            results[i] = sql_query
+    return results
+
+def convert_text_to_sql(transcription, num_beams=NUM_BEAMS, quantize=QUANTIZE):
+    # One question through the batched path; encode_question adds the instruction prefix
+    return convert_texts_to_sql([transcription], num_beams=num_beams, quantize=quantize)[0]
+
+if __name__ == "__main__":
+    # Example: Pass the transcription text from the frontend or backend, several questions are
+    # translated in one batch
+    transcriptions = sys.argv[1:] or ["What are the total sales for the last quarter?"]
+    for sql_query in convert_texts_to_sql(transcriptions):
+        print("Generated SQL Query:", sql_query)
@@ -0,0 +1,176 @@
+import os
+import re
+import sys
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+from get_schema import CACHE_DIR
+
+# Content-addressed cache of query results, keyed by (database fingerprint, normalized SQL, row
+# cap). The fingerprint (see get_schema.database_fingerprint) changes whenever the database file
+# is written or replaced, so stale results are never served. Results are stored as the exact
+# zlib-compressed NDJSON bytes of the sql_results/ hand-off, so a hit is written back to disk
+# without running the query or re-encoding a single row. The least recently used entries are
+# evicted above MAX_BYTES of compressed data. Queries whose result can change while the database
+# does not (random(), 'now', CURRENT_TIMESTAMP) are never stored. Set RESULT_CACHE_BYPASS=1 to
+# skip the cache entirely.
+CACHE_PATH = os.environ.get("RESULT_CACHE_PATH", os.path.join(CACHE_DIR, "result_cache.db"))
+MAX_BYTES = int(os.environ.get("RESULT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+MAX_ENTRY_BYTES = int(os.environ.get("RESULT_CACHE_MAX_ENTRY_BYTES", str(64 * 1024 * 1024)))  # Uncompressed
+COMPRESSION_LEVEL = 6
+_TOKEN_RE = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*"|`[^`]*`|\[[^\]]*\]|--[^\n]*|/\*.*?\*/|\s+)""", re.S)
+_NONDETERMINISTIC_RE = re.compile(
+    r"\b(random|randomblob|changes|total_changes|last_insert_rowid)\s*\(|\bcurrent_(timestamp|date|time)\b", re.I)
+
+def bypass_requested():
+    return os.environ.get("RESULT_CACHE_BYPASS", "").lower() in ("1", "true", "yes")
+
+def normalize_sql(sql):
+    # Comments dropped, whitespace outside literals and quoted names collapsed, trailing ';'
+    # removed. Case is kept: it names the result columns and matters inside literals.
+    parts = []
+    for token in _TOKEN_RE.split(sql):
+        if not token:
+            continue
+        if token.startswith("--") or token.startswith("/*") or token.isspace():
+            if parts and parts[-1] != " ":
+                parts.append(" ")
+        else:
+            parts.append(token)
+    return "".join(parts).strip().rstrip(";").strip()
+
+def is_deterministic(sql):
+    # Looks only at the code outside literals, comments and quoted names, except for the
+    # 'now' argument of the date and time functions (SQLite also reads an unknown "now" as a string)
+    code = []
+    for token in _TOKEN_RE.split(sql):
+        if token[:1] in ("'", '"') and token[1:-1].strip().lower() == "now":
+            return False
+        if token.startswith("'"):
+            code.append("''")
+        elif token[:1] in ('"', "`", "[") or token.startswith("--") or token.startswith("/*"):
+            code.append(" ")
+        else:
+            code.append(token)
+    return _NONDETERMINISTIC_RE.search("".join(code)) is None
+
+def cache_key(fingerprint, sql, max_rows):
+    parts = [fingerprint, normalize_sql(sql), str(max_rows)]
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+def _connect(path=None):
+    path = path or CACHE_PATH
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")  # Query threads and other processes read while one writes
+    conn.execute("""CREATE TABLE IF NOT EXISTS results (
+        key TEXT PRIMARY KEY,
+        database TEXT NOT NULL,
+        fingerprint TEXT NOT NULL,
+        query TEXT NOT NULL,
+        columns TEXT NOT NULL,
+        row_count INTEGER NOT NULL,
+        truncated INTEGER NOT NULL,
+        data BLOB NOT NULL,
+        raw_bytes INTEGER NOT NULL,
+        stored_bytes INTEGER NOT NULL,
+        created_at REAL NOT NULL,
+        last_access REAL NOT NULL,
+        hits INTEGER NOT NULL DEFAULT 0
+    )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS results_last_access ON results(last_access)")
+    conn.execute("CREATE INDEX IF NOT EXISTS results_database ON results(database, fingerprint)")
+    conn.execute("""CREATE TABLE IF NOT EXISTS stats (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        hits INTEGER NOT NULL DEFAULT 0,
+        misses INTEGER NOT NULL DEFAULT 0,
+        bytes_saved INTEGER NOT NULL DEFAULT 0
+    )""")
+    conn.execute("INSERT OR IGNORE INTO stats(id) VALUES (1)")
+    return conn
+
+def get(fingerprint, sql, max_rows, path=None):
+    # Returns None on a miss, else {"query", "columns", "row_count", "truncated", "data", "raw_bytes"}
+    # where data is the uncompressed NDJSON bytes
+    if bypass_requested():
+        return None
+    conn = _connect(path)
+    try:
+        with conn:
+            key = cache_key(fingerprint, sql, max_rows)
+            row = conn.execute(
+                "SELECT query, columns, row_count, truncated, data, raw_bytes FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE results SET last_access = ?, hits = hits + 1 WHERE key = ?", (time.time(), key))
+    finally:
+        conn.close()
+    query, columns, row_count, truncated, data, raw_bytes = row
+    return {"query": query, "columns": json.loads(columns), "row_count": row_count,
+            "truncated": bool(truncated), "data": zlib.decompress(data), "raw_bytes": raw_bytes}
+
+def put(database_path, fingerprint, sql, max_rows, columns, row_count, truncated, data,
+        max_bytes=MAX_BYTES, path=None):
+    # data: the NDJSON bytes as written to queryN.ndjson. Returns the stored (compressed) size,
+    # or 0 if the result was not cached.
+    if bypass_requested() or len(data) > MAX_ENTRY_BYTES or not is_deterministic(sql):
+        return 0
+    compressed = zlib.compress(data, COMPRESSION_LEVEL)
+    conn = _connect(path)
+    try:
+        with conn:
+            now = time.time()
+            database = os.path.abspath(database_path)
+            # Results of earlier versions of this database can never be hit again
+            conn.execute("DELETE FROM results WHERE database = ? AND fingerprint != ?", (database, fingerprint))
+            conn.execute(
+                "INSERT OR REPLACE INTO results(key, database, fingerprint, query, columns, row_count, truncated, "
+                "data, raw_bytes, stored_bytes, created_at, last_access) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (cache_key(fingerprint, sql, max_rows), database, fingerprint, sql, json.dumps(columns), row_count,
+                 int(truncated), compressed, len(data), len(compressed), now, now),
+            )
+            # Evict least recently used entries until the stored size is within max_bytes
+            conn.execute(
+                "DELETE FROM results WHERE key IN (SELECT key FROM (SELECT key, SUM(stored_bytes) OVER "
+                "(ORDER BY last_access DESC, key) AS running FROM results) WHERE running > ?)",
+                (max_bytes,),
+            )
+    finally:
+        conn.close()
+    return len(compressed)
+
+def record(hits, misses, bytes_saved, path=None):
+    # Running totals for `python result_cache.py stats`, updated once per batch of queries
+    if bypass_requested():
+        return
+    conn = _connect(path)
+    try:
+        with conn:
+            conn.execute("UPDATE stats SET hits = hits + ?, misses = misses + ?, bytes_saved = bytes_saved + ? WHERE id = 1",
+                         (hits, misses, bytes_saved))
+    finally:
+        conn.close()
+
+def stats(path=None):
+    conn = _connect(path)
+    try:
+        hits, misses, bytes_saved = conn.execute("SELECT hits, misses, bytes_saved FROM stats WHERE id = 1").fetchone()
+        entries, raw_bytes, stored_bytes = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(raw_bytes), 0), COALESCE(SUM(stored_bytes), 0) FROM results").fetchone()
+        lookups = hits + misses
+        return {"entries": entries, "hits": hits, "misses": misses,
+                "hit_rate": round(hits / lookups, 3) if lookups else 0.0, "bytes_saved": bytes_saved,
+                "raw_bytes": raw_bytes, "stored_bytes": stored_bytes}
+    finally:
+        conn.close()
+
+# Usage: python result_cache.py stats
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "stats":
+        print(json.dumps(stats()))
+    else:
+        print("Usage: python result_cache.py stats")
+        sys.exit(1)
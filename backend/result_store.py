@@ -0,0 +1,143 @@
+import os
+import json
+import random
+
+# Hand-off format between query execution and GenerateGraph.py:
+#   sql_results/manifest.json   {"format": "ndjson", "version": 1, "queries": [entry, ...]}
+#   sql_results/queryN.ndjson   one JSON array per row, values in the order of entry["columns"]
+# where entry is {"query", "file", "columns", "row_count"} plus "error" for failed queries.
+# The legacy pretty-printed sql_results.json ([{"query", "rows"}, ...]) is still accepted.
+RESULTS_DIR = "sql_results"
+MANIFEST_NAME = "manifest.json"
+LEGACY_RESULTS_FILE = "sql_results.json"
+FORMAT_VERSION = 1
+
+def default_results_path():
+    manifest_path = os.path.join(RESULTS_DIR, MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        return manifest_path
+    return LEGACY_RESULTS_FILE
+
+def load_results(path=None):
+    # Returns the list of result entries without reading any rows. For the legacy
+    # format the rows are already parsed and kept on the entry.
+    path = path or default_results_path()
+    if os.path.isdir(path):
+        path = os.path.join(path, MANIFEST_NAME)
+
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    if isinstance(data, dict) and data.get("format") == "ndjson":
+        base_dir = os.path.dirname(os.path.abspath(path))
+        entries = []
+        for entry in data["queries"]:
+            entry = dict(entry)
+            if entry.get("file"):
+                entry["path"] = os.path.join(base_dir, entry["file"])
+            entries.append(entry)
+        return entries
+
+    # Legacy sql_results.json
+    entries = []
+    for result in data:
+        rows = result.get("rows") or []
+        entries.append({
+            "query": result["query"],
+            "columns": list(rows[0].keys()) if rows else [],
+            "row_count": len(rows),
+            "rows": rows,
+            "error": result.get("error"),
+        })
+    return entries
+
+def iter_tuples(entry):
+    # Streams rows as lists in column order
+    if "rows" in entry:
+        columns = entry["columns"]
+        for row in entry["rows"]:
+            yield [row.get(column) for column in columns]
+        return
+    if not entry.get("path"):
+        return
+    with open(entry["path"], "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def iter_rows(entry):
+    # Streams rows as dicts, the shape the LLM prompts have always shown
+    if "rows" in entry:
+        yield from entry["rows"]
+        return
+    columns = entry["columns"]
+    for values in iter_tuples(entry):
+        yield dict(zip(columns, values))
+
+def reservoir_sample(iterable, k, rng=random):
+    # Single-pass uniform sample of k items (Algorithm R), keeping the original order of the picks
+    reservoir = []
+    for i, item in enumerate(iterable):
+        if i < k:
+            reservoir.append((i, item))
+        else:
+            j = rng.randint(0, i)
+            if j < k:
+                reservoir[j] = (i, item)
+    return [item for _, item in sorted(reservoir, key=lambda pair: pair[0])]
+
+def load_frame(entry):
+    # Full result as a pandas DataFrame, built from row tuples so no per-row dicts are created
+    import pandas as pd
+    if "rows" in entry:
+        return pd.DataFrame(entry["rows"], columns=entry["columns"] or None)
+    return pd.DataFrame.from_records(iter_tuples(entry), columns=entry["columns"])
+
+def prepare_results_dir(results_dir=RESULTS_DIR):
+    # Removes the previous run's files before new results are written
+    os.makedirs(results_dir, exist_ok=True)
+    # The manifest goes first so a concurrent reader never follows it to a deleted file
+    manifest_path = os.path.join(results_dir, MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    for name in os.listdir(results_dir):
+        if name.endswith(".ndjson"):
+            os.remove(os.path.join(results_dir, name))
+    return results_dir
+
+def json_value(value):
+    if isinstance(value, bytes):
+        return f"0x{value.hex()}"
+    return value
+
+def write_query_result(results_dir, index, query, columns, rows, error=None):
+    # Streams rows (an iterable of sequences) to queryN.ndjson and returns the manifest entry
+    entry = {"query": query, "file": None, "columns": list(columns), "row_count": 0}
+    if error is not None:
+        entry["error"] = error
+        return entry
+
+    file_name = f"query{index}.ndjson"
+    with open(os.path.join(results_dir, file_name), "w", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps([json_value(value) for value in row], default=str))
+            f.write("\n")
+            entry["row_count"] += 1
+    entry["file"] = file_name
+    return entry
+
+def write_query_ndjson(results_dir, index, query, columns, data, row_count):
+    # Writes already encoded NDJSON bytes (e.g. from the result cache) and returns the manifest entry
+    file_name = f"query{index}.ndjson"
+    with open(os.path.join(results_dir, file_name), "wb") as f:
+        f.write(data)
+    return {"query": query, "file": file_name, "columns": list(columns), "row_count": row_count}
+
+def write_manifest(results_dir, entries):
+    # Written last and atomically, so readers never see a manifest pointing at partial files
+    manifest_path = os.path.join(results_dir, MANIFEST_NAME)
+    tmp_path = f"{manifest_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"format": "ndjson", "version": FORMAT_VERSION, "queries": entries}, f)
+    os.replace(tmp_path, manifest_path)
+    return manifest_path
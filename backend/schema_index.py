@@ -0,0 +1,196 @@
+import re
+import os
+import sys
+import json
+import math
+from collections import Counter
+from get_schema import CACHE_DIR, database_key, load_schema
+from instrumentation import request, span, annotate
+
+# Lexical retrieval over the schema so prompts only carry the tables a question needs
+INDEX_VERSION = 1
+DEFAULT_TOKEN_BUDGET = 1500
+MAX_SEED_TABLES = 6
+MAX_SAMPLE_CHARS = 40
+BM25_K1 = 1.5
+BM25_B = 0.75
+_memory_index = {}
+
+def estimate_tokens(text):
+    # Roughly 4 characters per token for English text and JSON, good enough for quota planning
+    return max(1, math.ceil(len(text) / 4))
+
+def tokenize(text):
+    # Split identifiers like "OrderDetails" and "units_sold" into words, lowercase and
+    # strip a plural "s" so "orders" in a question matches the "Orders" table
+    words = re.findall(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+", str(text))
+    tokens = []
+    for word in words:
+        word = word.lower()
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        tokens.append(word)
+    return tokens
+
+def build_index(schema):
+    # One BM25 document per table: the table name counts three times, column names twice and
+    # sample values once, so a name match outranks a value that happens to appear in the data
+    documents = {}
+    # SQLite's internal tables (sqlite_sequence lists other table names) only add noise
+    tables = {table: details for table, details in schema.items() if not table.startswith("sqlite_")}
+    graph = {table: set() for table in tables}
+    for table, details in tables.items():
+        terms = tokenize(table) * 3
+        for column in details["columns"]:
+            terms += tokenize(column["name"]) * 2
+        for row in details["sample_data"]:
+            for value in row.values():
+                if isinstance(value, str):
+                    terms += tokenize(value[:MAX_SAMPLE_CHARS])
+        documents[table] = dict(Counter(terms))
+
+        # Foreign keys are undirected join edges
+        for fk in details["foreign_keys"]:
+            if fk["to_table"] in graph and fk["to_table"] != table:
+                graph[table].add(fk["to_table"])
+                graph[fk["to_table"]].add(table)
+
+    document_frequency = Counter()
+    for terms in documents.values():
+        document_frequency.update(terms.keys())
+    lengths = {table: sum(terms.values()) for table, terms in documents.items()}
+    average_length = sum(lengths.values()) / len(lengths) if lengths else 0.0
+
+    return {
+        "version": INDEX_VERSION,
+        "documents": documents,
+        "lengths": lengths,
+        "average_length": average_length,
+        "document_frequency": dict(document_frequency),
+        "graph": {table: sorted(neighbours) for table, neighbours in graph.items()},
+    }
+
+def get_index(database_path):
+    # The index is built once per database fingerprint and kept in memory and on disk. Like the
+    # schema cache there is one file per database path, overwritten when the fingerprint changes.
+    schema, _, stats = load_schema(database_path)
+    fingerprint = stats["fingerprint"]
+    cached = _memory_index.get(fingerprint)
+    if cached is not None:
+        return schema, cached, stats
+
+    index_path = os.path.join(CACHE_DIR, f"schema-index-{database_key(database_path)}.json")
+    try:
+        with open(index_path, "r") as f:
+            index = json.load(f)
+        if index.get("version") != INDEX_VERSION or index.get("fingerprint") != fingerprint:
+            raise ValueError("stale index")
+    except (OSError, ValueError):
+        index = build_index(schema)
+        index["fingerprint"] = fingerprint
+        tmp_path = f"{index_path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            with open(tmp_path, "w") as f:
+                json.dump(index, f)
+            os.replace(tmp_path, index_path)
+        except OSError:
+            pass
+    _memory_index[fingerprint] = index
+    return schema, index, stats
+
+def score_tables(index, question):
+    query_terms = set(tokenize(question))
+    total = len(index["documents"])
+    average_length = index["average_length"] or 1.0
+    scores = {}
+    for table, terms in index["documents"].items():
+        length = index["lengths"][table]
+        score = 0.0
+        for term in query_terms:
+            frequency = terms.get(term)
+            if not frequency:
+                continue
+            df = index["document_frequency"][term]
+            idf = math.log(1 + (total - df + 0.5) / (df + 0.5))
+            score += idf * frequency * (BM25_K1 + 1) / (frequency + BM25_K1 * (1 - BM25_B + BM25_B * length / average_length))
+        if score > 0:
+            scores[table] = score
+    return scores
+
+def _compact_table(details, include_samples=True):
+    entry = {"columns": [f"{col['name']} {col['type']}".strip() for col in details["columns"]]}
+    if details["primary_keys"]:
+        entry["pk"] = details["primary_keys"]
+    if details["foreign_keys"]:
+        entry["fk"] = [f"{fk['from_column']}->{fk['to_table']}.{fk['to_column']}" for fk in details["foreign_keys"]]
+    if details.get("typed_columns"):
+        entry["typed"] = details["typed_columns"]
+    if include_samples and details["sample_data"]:
+        # Values only, in column order; long strings are truncated since they rarely help the LLM
+        entry["sample"] = [
+            [value[:MAX_SAMPLE_CHARS] if isinstance(value, str) else value for value in row.values()]
+            for row in details["sample_data"]
+        ]
+    return entry
+
+def _serialize(entries):
+    return json.dumps(entries, separators=(",", ":"), default=str)
+
+def prune_schema(database_path, question, token_budget=DEFAULT_TOKEN_BUDGET, max_seed_tables=MAX_SEED_TABLES):
+    # Returns the tables relevant to the question plus their join neighbours, compactly serialized
+    # and kept within token_budget, together with token estimates for the pruned and full schema
+    with span("schema_index.get_index"):
+        schema, index, stats = get_index(database_path)
+    with span("schema_index.score"):
+        scores = score_tables(index, question)
+
+    if scores:
+        seeds = sorted(scores, key=lambda table: -scores[table])[:max_seed_tables]
+    else:
+        # Nothing matched lexically: fall back to the most connected tables
+        seeds = sorted(index["graph"], key=lambda table: -len(index["graph"][table]))
+
+    candidates = list(seeds)
+    for table in seeds:
+        for neighbour in index["graph"].get(table, []):
+            if neighbour not in candidates:
+                candidates.append(neighbour)
+
+    entries = {}
+    for table in candidates:
+        # Prefer the table with its sample rows, then without, then skip it.
+        # The best match is always kept, even if its bare columns exceed the budget.
+        for include_samples in (True, False):
+            trial = dict(entries)
+            trial[table] = _compact_table(schema[table], include_samples)
+            if estimate_tokens(_serialize(trial)) <= token_budget or (not entries and not include_samples):
+                entries = trial
+                break
+
+    pruned = _serialize(entries)
+    annotate(tables=len(entries), candidates=len(candidates))
+    return {
+        "schema": pruned,
+        "tables": list(entries),
+        "estimated_tokens": estimate_tokens(pruned),
+        "full_tokens": estimate_tokens(load_schema(database_path)[1]),
+        "token_budget": token_budget,
+        "fingerprint": stats["fingerprint"],
+    }
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Usage: python schema_index.py <database> <question> [token_budget]")
+        sys.exit(1)
+
+    from ingest import resolve_database
+    DATABASE_PATH = resolve_database(sys.argv[1])
+    question = sys.argv[2]
+    budget = int(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_TOKEN_BUDGET
+    try:
+        with request("schema_index", budget=budget):
+            pruned = prune_schema(DATABASE_PATH, question, budget)
+        print(json.dumps(pruned))
+    except Exception as e:
+        print(json.dumps({"error": str(e)}))
@@ -5,7 +5,9 @@ const fs = require('fs');
 const axios = require('axios');
 const cors = require('cors');
 const { promisify } = require('util');
-const { exec } = require('child_process');
+const { execFile, spawn } = require('child_process');
+const readline = require('readline');
+const crypto = require('crypto');
 const app = express();
 require('dotenv').config();
 const uploadsDir = path.join(__dirname, 'uploads');
@@ -53,18 +55,166 @@ if (!fs.existsSync('uploads')) {
   fs.mkdirSync('uploads');
 }
 
-// Promisify the exec function for easier async/await usage
-const execAsync = promisify(exec);
+// Promisify the execFile function for easier async/await usage
+const execFileAsync = promisify(execFile);
 
-// Helper function to run Python scripts
-async function runPythonScript(scriptPath, args) {
-  const { stdout, stderr } = await execAsync(`python "${scriptPath}" "${args}"`);
+// Gemini model used for SQL generation; bump the prompt version when the prompts change
+// so cached answers to the old prompts are not reused
+const GEMINI_MODEL = "gemini-2.0-flash-thinking-exp-01-21";
+const EXECUTE_PROMPT_VERSION = 2;
+
+// Maximum estimated tokens of schema pasted into each LLM prompt
+const SCHEMA_TOKEN_BUDGET = parseInt(process.env.SCHEMA_TOKEN_BUDGET || '1500', 10);
+
+// Options for Python child processes; extraEnv adds variables such as RAZORX_REQUEST_ID, which
+// tags the traces of every script one HTTP request runs (see instrumentation.py)
+function pythonOptions(extraEnv) {
+  return { maxBuffer: 64 * 1024 * 1024, env: { ...process.env, ...extraEnv } };
+}
+
+// Helper function to run Python scripts. Arguments are passed without a shell,
+// so user text (e.g. the transcription) can't break out of the command line.
+async function runPythonScript(scriptPath, args, extraEnv) {
+  const { stdout, stderr } = await execFileAsync('python', [scriptPath, ...[].concat(args)], pythonOptions(extraEnv));
   if (stderr) throw new Error(stderr);
   return stdout.trim();
 }
 
-// Handle the file upload endpoint
-const sqlite3 = require('sqlite3').verbose();
+// Same as runPythonScript, with input written to the script's stdin
+function runPythonWithInput(scriptPath, args, input, extraEnv) {
+  return new Promise((resolve, reject) => {
+    const child = execFile('python', [scriptPath, ...[].concat(args)], pythonOptions(extraEnv), (error, stdout, stderr) => {
+      if (error) return reject(error);
+      if (stderr) return reject(new Error(stderr));
+      resolve(stdout.trim());
+    });
+    child.stdin.end(input);
+  });
+}
+
+// Long-lived Whisper worker so the model is loaded once instead of on every upload
+const TRANSCRIBE_TIMEOUT_MS = 120000;
+let transcriptionWorker = null;
+let transcriptionJobId = 0;
+const pendingTranscriptions = new Map();
+
+function getTranscriptionWorker() {
+  if (transcriptionWorker) return transcriptionWorker;
+
+  const workerScriptPath = path.join(__dirname, 'whisper', 'transcribe.py');
+  const worker = spawn('python', [workerScriptPath, '--worker']);
+
+  readline.createInterface({ input: worker.stdout }).on('line', (line) => {
+    let message;
+    try {
+      message = JSON.parse(line);
+    } catch (err) {
+      console.warn(`Unexpected transcription worker output: ${line}`);
+      return;
+    }
+    if (message.ready) {
+      console.log(`Transcription worker ready (model: ${message.model})`);
+      return;
+    }
+    const pending = pendingTranscriptions.get(message.id);
+    if (!pending) return;
+    if (message.started) {
+      // Ignore a late line from a worker the job was already taken away from
+      if (pending.worker === worker) startTranscriptionDecode(message.id, pending);
+      return;
+    }
+    pendingTranscriptions.delete(message.id);
+    clearTimeout(pending.timer);
+    if (message.error) {
+      pending.reject(new Error(message.error));
+    } else {
+      pending.resolve(message.text.trim());
+    }
+  });
+
+  worker.stderr.on('data', (data) => {
+    console.error(`Transcription worker stderr: ${data}`);
+  });
+
+  // A missing python or a broken pipe is reported here; unhandled, it would crash the server
+  worker.on('error', (err) => {
+    console.error(`Transcription worker error: ${err.message}`);
+    failTranscriptionWorker(worker, `Transcription worker failed: ${err.message}`);
+  });
+  worker.stdin.on('error', (err) => {
+    console.error(`Transcription worker stdin error: ${err.message}`);
+    failTranscriptionWorker(worker, `Transcription worker failed: ${err.message}`);
+  });
+
+  worker.on('exit', (code) => {
+    console.error(`Transcription worker exited with code ${code}`);
+    failTranscriptionWorker(worker, 'Transcription worker exited');
+  });
+
+  transcriptionWorker = worker;
+  return worker;
+}
+
+// Rejects the jobs sent to this worker and forgets it; the next job spawns a fresh one
+function failTranscriptionWorker(worker, reason) {
+  if (transcriptionWorker === worker) transcriptionWorker = null;
+  for (const [id, pending] of pendingTranscriptions) {
+    if (pending.worker !== worker) continue;
+    pendingTranscriptions.delete(id);
+    clearTimeout(pending.timer);
+    pending.reject(new Error(reason));
+  }
+  worker.kill('SIGKILL');
+}
+
+// Until the worker reports the job as started it is only queued behind other decodes, which can
+// legitimately take longer than one timeout; the worker answers it with "timed out in queue" once
+// it gets to it. The grace period covers that answer, and missing it only fails this request.
+const TRANSCRIBE_QUEUE_GRACE_MS = 30000;
+
+function sendTranscriptionJob(id, pending) {
+  pending.worker = getTranscriptionWorker();
+  pending.started = false;
+  clearTimeout(pending.timer);
+  pending.timer = setTimeout(() => {
+    pendingTranscriptions.delete(id);
+    pending.reject(new Error('Transcription timed out in queue'));
+  }, TRANSCRIBE_TIMEOUT_MS + TRANSCRIBE_QUEUE_GRACE_MS);
+  const job = { id, audio: pending.audioPath, language: pending.language, timeout: TRANSCRIBE_TIMEOUT_MS / 1000 };
+  pending.worker.stdin.write(JSON.stringify(job) + '\n');
+}
+
+// Times the decode itself. The worker only checks deadlines between batches, so one that doesn't
+// answer a started job in time is wedged in the decode and never answers again: fail the jobs of
+// that decode, replace the worker and resend the jobs still queued in it, with a fresh timeout.
+function startTranscriptionDecode(id, pending) {
+  pending.started = true;
+  clearTimeout(pending.timer);
+  pending.timer = setTimeout(() => {
+    const worker = pending.worker;
+    if (transcriptionWorker === worker) transcriptionWorker = null;
+    worker.kill('SIGKILL');
+    for (const [otherId, other] of pendingTranscriptions) {
+      if (other.worker !== worker) continue;
+      if (other.started) {
+        pendingTranscriptions.delete(otherId);
+        clearTimeout(other.timer);
+        other.reject(new Error('Transcription timed out'));
+      } else {
+        sendTranscriptionJob(otherId, other);
+      }
+    }
+  }, TRANSCRIBE_TIMEOUT_MS);
+}
+
+function transcribeAudio(audioPath, language = 'en') {
+  return new Promise((resolve, reject) => {
+    const id = ++transcriptionJobId;
+    const pending = { resolve, reject, audioPath, language };
+    pendingTranscriptions.set(id, pending);
+    sendTranscriptionJob(id, pending);
+  });
+}
 
 //Handle Database.db replace and uploads
 // Route to replace database.db
@@ -82,6 +232,17 @@ app.post('/replacedatabase', upload.single('database'), (req, res) => {
           return res.status(500).send('Error replacing database: ' + err.message);
       }
       res.send('Database replaced successfully.');
+
+      // Build the typed copy (numeric/date companions for formatted text columns) and warm its
+      // schema cache so the next /execute doesn't pay for introspection
+      execFile('python', [path.join(__dirname, 'ingest.py'), oldDbPath], pythonOptions(), (error, stdout) => {
+          if (error) {
+              // ingest.py prints {"error": ...} and exits non-zero when the build fails
+              console.error(`Database ingest error: ${stdout.trim() || error.message}`);
+              return;
+          }
+          console.log(`Database ingested: ${stdout.trim()}`);
+      });
   });
 });
 
@@ -91,30 +252,23 @@ app.post('/upload', upload.single('audio'), async (req, res) => {
     const audioPath = req.file.path;
     console.log(`File uploaded: ${audioPath}`);
 
-    const transcribeScriptPath = path.join(__dirname, 'whisper', 'transcribe.py');
-
-    // Step 1: Transcribe the audio
-    const transcription = await runPythonScript(transcribeScriptPath, audioPath);
+    // Step 1: Transcribe the audio on the warm worker
+    let transcription;
+    try {
+      transcription = await transcribeAudio(audioPath);
+    } finally {
+      // Step 3: Clean up this upload only; other clips may still be queued in the worker
+      fs.unlink(audioPath, (err) => {
+        if (err) {
+          console.error(`Error deleting file ${audioPath}:`, err);
+        }
+      });
+    }
     console.log(`Transcription from Python: ${transcription}`);
 
     // Step 2: Return the transcription to the client
     res.json({ transcription });
 
-    // Step 3: Clean up uploaded files
-    fs.readdir(uploadsDir, (err, files) => {
-      if (err) {
-        console.error('Error reading uploads directory:', err);
-        return;
-      }
-      for (const file of files) {
-        fs.unlink(path.join(uploadsDir, file), (err) => {
-          if (err) {
-            console.error(`Error deleting file ${file}:`, err);
-          }
-        });
-      }
-    });
-
   } catch (error) {
     console.error('Error in /upload endpoint:', error);
     res.status(500).json({ error: 'Internal Server Error' });
@@ -125,103 +279,115 @@ app.post('/upload', upload.single('audio'), async (req, res) => {
 app.post('/execute', async (req, res) => {
   try {
     const { transcription } = req.body;
-
-    // Step 1: Get the schema
-    const getSchemaScriptPath = path.join(__dirname, 'get_schema.py');
-    const schema = await runPythonScript(getSchemaScriptPath, 'database.db');
-
-    // Step 2: Call Groq API to generate SQL queries
-    const genAI = new GoogleGenerativeAI(process.env.GOOGLE_API_KEY);
-    const model = genAI.getGenerativeModel({ model: "gemini-2.0-flash-thinking-exp-01-21" });
-
-    const prompt = `Given only the schema with sample values of my database:\n${schema}\n\n
-                    Question: ${transcription}\n\n
-                    Generate multiple SQLite3 (SQL) queries to directly answer the given question and provide additional context for insights and reporting.
-                    Every SQL query must start with 'SQLQUERY:'.\n
-                    - The queries must help in visualization or reporting.\n
-                    - Ensure clarity in table structures by using JOINs where necessary.\n
-                    - Do NOT include explanations, comments, or metadata in your response.\n
-                    - If the input question is personal or inappropriate, return only 'REASON:' followed by the reason.\n
-                    - If the question is too vague, generate contextual SQL queries that help understand the subject.\n
-                    - Do NOT mix 'REASON:' with 'SQLQUERY:'. Return only one type of response.\n
-                    - Prioritize providing at least some relevant SQL queries for vague questions instead of returning a reason.\n
-                    - Adhere strictly to the provided schema.
-                    - Avoid giving queries that might return the same result.\n
-                    - Be very careful with the column names.\n`;
-
-
-    const apiResponse = await model.generateContent(prompt);
-    const sqlQueries = await apiResponse.response.text(); // Extract text
-    //console.log(sqlQueries);
-    // Step 2.1: Check if response contains a reason instead of queries
-    if (sqlQueries.startsWith('REASON:')) {
-      const reason = sqlQueries.replace('REASON:', '').trim();
-      console.warn('API returned a reason:', reason);
-      return res.status(400).json({ error: 'Query not generated', reason });
+    const traceEnv = { RAZORX_REQUEST_ID: crypto.randomUUID() };
+
+    // Step 1: Get the part of the schema relevant to the question
+    const schemaIndexScriptPath = path.join(__dirname, 'schema_index.py');
+    const prunedSchema = JSON.parse(await runPythonScript(schemaIndexScriptPath, ['database.db', transcription, String(SCHEMA_TOKEN_BUDGET)], traceEnv));
+    if (prunedSchema.error) throw new Error(prunedSchema.error);
+    const schema = prunedSchema.schema;
+    console.log(`Schema prompt: ${prunedSchema.tables.length} tables, ~${prunedSchema.estimated_tokens} tokens (full schema ~${prunedSchema.full_tokens})`);
+
+    // Step 2: Generate SQL queries, unless the same question was already answered for this schema.
+    // One cache entry covers both the generation and the refine call.
+    const llmCacheScriptPath = path.join(__dirname, 'llm_cache.py');
+    const cacheArgs = ['execute_sql', GEMINI_MODEL, String(EXECUTE_PROMPT_VERSION), `${prunedSchema.fingerprint}:${SCHEMA_TOKEN_BUDGET}`, transcription];
+    // A bypass skips the cached answer (and is counted as one); the fresh answer replaces it
+    const bypassCache = Boolean(req.body.bypassCache);
+    let queries = null;
+    const cached = JSON.parse(await runPythonScript(llmCacheScriptPath, ['get', ...(bypassCache ? ['--bypass'] : []), ...cacheArgs]));
+    if (cached.hit) {
+      queries = cached.value;
+      console.log(`LLM cache hit: reusing ${queries.length} queries`);
     }
 
-    // Step 2.2: Refine SQL queries
-    const refinePrompt = `Check for any syntax and logical errors in this: \n${sqlQueries}\n for the question \n${transcription}\n\n
-        Given the schema: \n${schema}\n
-        Ensure it is supported by SQLite3. If not, fix it to adhere to SQLite3. Remove any incomplete queries if you cannot find the context.
-        Return the SQLQueries in the exact same format after fixing. Do not add anything else in your response.
-        Ensure each query adheres strictly to the schema.`;
-
-
-    const apiResponseRefined = await model.generateContent(refinePrompt);
-    let sqlQueriesRefined = await apiResponseRefined.response.text();
-    //console.log(sqlQueriesRefined);
-    // Extract queries
-    let queries = sqlQueriesRefined
-      .split("\n")
-      .map(query => query.trim())
-      .filter(query => query.startsWith("SQLQUERY:"))
-      .map(query => query.replace(/^SQLQUERY:\s*/, ""));  // Ensures both "SQLQUERY: " and "SQLQUERY:" are handled
-
-    // Step 3: Execute all SQL queries
-    const db = new sqlite3.Database('database.db', sqlite3.OPEN_READWRITE, (err) => {
-      if (err) {
-        console.error('Database connection error:', err);
-        return res.status(500).json({ error: 'Database connection failed' });
+    if (!queries) {
+      // Step 2: Call Groq API to generate SQL queries
+      const genAI = new GoogleGenerativeAI(process.env.GOOGLE_API_KEY);
+      const model = genAI.getGenerativeModel({ model: GEMINI_MODEL });
+
+      const prompt = `Given only the schema with sample values of my database:\n${schema}\n\n
+                      Question: ${transcription}\n\n
+                      Generate multiple SQLite3 (SQL) queries to directly answer the given question and provide additional context for insights and reporting.
+                      Every SQL query must start with 'SQLQUERY:'.\n
+                      - The queries must help in visualization or reporting.\n
+                      - Ensure clarity in table structures by using JOINs where necessary.\n
+                      - Do NOT include explanations, comments, or metadata in your response.\n
+                      - If the input question is personal or inappropriate, return only 'REASON:' followed by the reason.\n
+                      - If the question is too vague, generate contextual SQL queries that help understand the subject.\n
+                      - Do NOT mix 'REASON:' with 'SQLQUERY:'. Return only one type of response.\n
+                      - Prioritize providing at least some relevant SQL queries for vague questions instead of returning a reason.\n
+                      - Adhere strictly to the provided schema.
+                      - Avoid giving queries that might return the same result.\n
+                      - Be very careful with the column names.\n
+                      - When a table lists "typed" columns, use them (e.g. SUM("Sales_value"), ORDER BY "Date_date") instead of CAST/REPLACE on the original text column.\n`;
+
+
+      const apiResponse = await model.generateContent(prompt);
+      const sqlQueries = await apiResponse.response.text(); // Extract text
+      //console.log(sqlQueries);
+      // Step 2.1: Check if response contains a reason instead of queries
+      if (sqlQueries.startsWith('REASON:')) {
+        const reason = sqlQueries.replace('REASON:', '').trim();
+        console.warn('API returned a reason:', reason);
+        return res.status(400).json({ error: 'Query not generated', reason });
       }
-    });
 
-    try {
-      let results = [];
-      for (const query of queries) {
-        try {
-          const rows = await new Promise((resolve, reject) => {
-            db.all(query, [], (err, rows) => {
-              if (err) {
-                console.error(`SQL Execution Error for query: ${query}`, err);
-                reject(err);
-              } else {
-                resolve(rows);
-              }
-            });
-          });
-          results.push({ query, rows });
-        } catch (queryError) {
-          results.push({ query, error: queryError.message || 'SQL execution failed' });
-        }
+      // Step 2.2: Refine SQL queries
+      const refinePrompt = `Check for any syntax and logical errors in this: \n${sqlQueries}\n for the question \n${transcription}\n\n
+          Given the schema: \n${schema}\n
+          Ensure it is supported by SQLite3. If not, fix it to adhere to SQLite3. Remove any incomplete queries if you cannot find the context.
+          Return the SQLQueries in the exact same format after fixing. Do not add anything else in your response.
+          Ensure each query adheres strictly to the schema.`;
+
+
+      const apiResponseRefined = await model.generateContent(refinePrompt);
+      let sqlQueriesRefined = await apiResponseRefined.response.text();
+      //console.log(sqlQueriesRefined);
+      // Extract queries
+      queries = sqlQueriesRefined
+        .split("\n")
+        .map(query => query.trim())
+        .filter(query => query.startsWith("SQLQUERY:"))
+        .map(query => query.replace(/^SQLQUERY:\s*/, ""));  // Ensures both "SQLQUERY: " and "SQLQUERY:" are handled
+
+      if (queries.length) {
+        await runPythonWithInput(llmCacheScriptPath, ['put', ...cacheArgs], JSON.stringify(queries));
       }
-      // Save SQL results as JSON
-      fs.writeFileSync("sql_results.json", JSON.stringify(results, null, 2));
+    }
 
-      // Call Python script to generate graphs
-      exec("python GenerateGraph.py", (error, stdout, stderr) => {
-          if (error) {
-              console.error(`Graph generation error: ${error.message}`);
-          }
-          if (stderr) {
-              console.error(`Graph generation stderr: ${stderr}`);
-          }
-          console.log(`Graph generation stdout: ${stdout}`);
-      });
-      res.json({ transcription, sqlQueries: queries, results });
-    } finally {
-      db.close();
+    // Step 3: Execute all SQL queries concurrently on read-only connections. The engine enforces
+    // a per-statement deadline and row cap, and writes the hand-off for GenerateGraph.py to
+    // sql_results/<request id>/, so overlapping requests never delete each other's result files.
+    // Queries already run against the same database contents are served from the result cache.
+    const executeScriptPath = path.join(__dirname, 'execute_queries.py');
+    const resultsDir = path.join('sql_results', traceEnv.RAZORX_REQUEST_ID);
+    const execution = JSON.parse(await runPythonWithInput(executeScriptPath, ['database.db', resultsDir], JSON.stringify(queries), traceEnv));
+    if (execution.error) throw new Error(execution.error);
+    const results = execution.results;
+    for (const result of results) {
+      if (result.error) {
+        console.error(`SQL Execution Error for query: ${result.query}`, result.error);
+      }
     }
+    console.log(`Executed ${results.length} queries in ${execution.seconds}s`);
+    const resultCache = execution.result_cache;
+    console.log(`Result cache: ${resultCache.hits}/${results.length} hits (${Math.round(resultCache.hit_rate * 100)}%), ${resultCache.bytes_saved} bytes saved`);
+
+    // Call Python script to generate graphs from this request's results, then drop them
+    execFile('python', ['GenerateGraph.py', resultsDir], pythonOptions(traceEnv), (error, stdout, stderr) => {
+        if (error) {
+            console.error(`Graph generation error: ${error.message}`);
+        }
+        if (stderr) {
+            console.error(`Graph generation stderr: ${stderr}`);
+        }
+        console.log(`Graph generation stdout: ${stdout}`);
+        fs.rm(resultsDir, { recursive: true, force: true }, (rmError) => {
+          if (rmError) console.error(`Failed to remove ${resultsDir}:`, rmError);
+        });
+    });
+    res.json({ transcription, sqlQueries: queries, results });
   } catch (error) {
     console.error('Error in /execute endpoint:', error);
     res.status(500).json({ error: 'Internal Server Error' });
@@ -237,4 +403,6 @@ app.use((err, req, res, next) => {
 // Start the server
 app.listen(port, () => {
   console.log(`Server running on http://localhost:${port}`);
+  // Warm the transcription worker so the first upload doesn't pay for model load
+  getTranscriptionWorker();
 });
\ No newline at end of file
@@ -0,0 +1,154 @@
+import sys
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in for the Groq chat-completions endpoint, used to exercise llm_client.py without
+# network access or quota. It enforces its own tokens-per-minute limit and answers 429 with a
+# Retry-After header like the real service, and can fail the first requests with a 5xx.
+# It also answers Gemini generateContent requests (POST /v1beta/models/<model>:generateContent),
+# so GenerateGraph.py can run against it with GEMINI_BASE_URL set to gemini_base_url.
+DEFAULT_SQL_RESPONSE = "1. SELECT COUNT(*) FROM Orders;\n2. SELECT cname, phone FROM Customer LIMIT 10;"
+
+class StubLLMServer:
+    def __init__(self, host="127.0.0.1", port=0, tokens_per_minute=None, fail_first=0,
+                 latency=0.0, response_text=DEFAULT_SQL_RESPONSE, gemini_response_text=None, window_seconds=60.0):
+        self.tokens_per_minute = tokens_per_minute
+        self.window_seconds = window_seconds  # Length of the rate-limit "minute"; tests shorten it
+        self.fail_first = fail_first
+        self.latency = latency
+        # A string, or a callable taking the request payload and returning the completion text
+        self.response_text = response_text
+        # Same for Gemini requests; defaults to response_text
+        self.gemini_response_text = gemini_response_text if gemini_response_text is not None else response_text
+        self.stats = {"requests": 0, "completed": 0, "rate_limited": 0, "failed": 0}
+        self._window = []  # (timestamp, tokens) accepted in the last minute
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/openai/v1/chat/completions"
+
+    @property
+    def gemini_base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _admit(self, tokens):
+        # Returns None if the request fits in the rolling window, else seconds to wait
+        with self._lock:
+            self.stats["requests"] += 1
+            if self.stats["requests"] <= self.fail_first:
+                self.stats["failed"] += 1
+                return "fail"
+            if self.tokens_per_minute is None:
+                return None
+            now = time.time()
+            self._window = [(t, n) for t, n in self._window if now - t < self.window_seconds]
+            used = sum(n for _, n in self._window)
+            if used + tokens > self.tokens_per_minute and self._window:
+                self.stats["rate_limited"] += 1
+                return max(self.window_seconds - (now - self._window[0][0]), 0.1)
+            self._window.append((now, tokens))
+            return None
+
+    def _completion_text(self, payload, gemini=False):
+        response_text = self.gemini_response_text if gemini else self.response_text
+        if callable(response_text):
+            return response_text(payload)
+        return response_text
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # Keep-alive, like the real endpoint
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, body, headers=None):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                try:
+                    payload = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    return self._send(400, {"error": {"message": "Invalid JSON"}})
+
+                gemini = ":generateContent" in self.path
+                if gemini:
+                    prompt = " ".join(part.get("text", "") for content in payload.get("contents", [])
+                                      for part in content.get("parts", []))
+                else:
+                    prompt = " ".join(message.get("content", "") for message in payload.get("messages", []))
+                prompt_tokens = max(1, len(prompt) // 4)
+                verdict = stub._admit(prompt_tokens)
+                if verdict == "fail":
+                    return self._send(503, {"error": {"message": "Service unavailable"}})
+                if verdict is not None:
+                    return self._send(429, {"error": {"message": "Rate limit reached for tokens per minute", "type": "tokens"}},
+                                      {"Retry-After": f"{verdict:.2f}"})
+
+                if stub.latency:
+                    time.sleep(stub.latency)
+                text = stub._completion_text(payload, gemini)
+                with stub._lock:
+                    stub.stats["completed"] += 1
+                if gemini:
+                    return self._send(200, {
+                        "candidates": [{"content": {"role": "model", "parts": [{"text": text}]},
+                                        "finishReason": "STOP", "index": 0}],
+                        "usageMetadata": {"promptTokenCount": prompt_tokens, "candidatesTokenCount": max(1, len(text) // 4),
+                                          "totalTokenCount": prompt_tokens + max(1, len(text) // 4)},
+                        "modelVersion": self.path.split("/models/", 1)[-1].split(":", 1)[0],
+                    })
+                self._send(200, {
+                    "id": f"stub-{stub.stats['completed']}",
+                    "object": "chat.completion",
+                    "model": payload.get("model", "stub"),
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": max(1, len(text) // 4)},
+                })
+
+        return Handler
+
+if __name__ == "__main__":
+    # python stub_llm_server.py [port] [tokens_per_minute]  -- then point GROQ_API_URL at it
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8089
+    tpm = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    server = StubLLMServer(port=port, tokens_per_minute=tpm)
+    print(f"Stub Groq endpoint at {server.url}")
+    print(f"Stub Gemini endpoint at {server.gemini_base_url}")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
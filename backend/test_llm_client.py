@@ -0,0 +1,67 @@
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from llm_client import LLMClient, TokenBucket
+from stub_llm_server import StubLLMServer
+
+# LLMClient against the local stand-in for the Groq endpoint (stub_llm_server.py)
+def _payload(prompt_tokens, max_tokens):
+    # estimate_tokens counts 4 characters per token, as the stub does
+    return {"model": "stub", "messages": [{"role": "user", "content": "x" * (prompt_tokens * 4)}],
+            "max_tokens": max_tokens}
+
+class LLMClientTest(unittest.TestCase):
+    def test_queues_requests_beyond_the_token_budget(self):
+        # 7 requests of 300 tokens against a 2000 tokens/minute bucket: the last ones must wait
+        # for about 100 tokens to refill, at 2000 / 60 per second
+        completion = "y" * (200 * 4)  # Uses the whole max_tokens, so nothing is refunded
+        with StubLLMServer(response_text=completion) as server:
+            client = LLMClient(server.url, "stub", TokenBucket(tokens_per_minute=2000))
+            start = time.monotonic()
+            with ThreadPoolExecutor(max_workers=7) as pool:
+                responses = list(pool.map(lambda _: client.chat(_payload(100, 200)), range(7)))
+            elapsed = time.monotonic() - start
+
+        self.assertTrue(all(response.status_code == 200 for response in responses))
+        self.assertGreaterEqual(elapsed, 2.5)
+        metrics = client.metrics()
+        self.assertGreaterEqual(metrics["bucket"]["waited"], 1)
+        self.assertEqual(metrics["rate_limited"], 0)
+
+    def test_reserves_a_completion_budget_without_max_tokens(self):
+        client = LLMClient("http://127.0.0.1:9", "stub", TokenBucket(tokens_per_minute=100000))
+        payload = _payload(100, None)
+        self.assertGreater(client.estimate_request_tokens(payload), 100)
+
+    def test_retries_after_429(self):
+        # The server's own limit (150 tokens per 1s window) is tighter than the client's bucket,
+        # as when another process shares the key: the second request is rejected once and retried
+        with StubLLMServer(tokens_per_minute=150, window_seconds=1.0) as server:
+            client = LLMClient(server.url, "stub", TokenBucket(tokens_per_minute=100000))
+            with ThreadPoolExecutor(max_workers=2) as pool:
+                responses = list(pool.map(lambda _: client.chat(_payload(100, 50)), range(2)))
+            stats = dict(server.stats)
+
+        self.assertTrue(all(response.status_code == 200 for response in responses))
+        self.assertGreaterEqual(stats["rate_limited"], 1)
+        self.assertEqual(stats["completed"], 2)
+        metrics = client.metrics()
+        self.assertGreaterEqual(metrics["rate_limited"], 1)
+        self.assertGreaterEqual(metrics["retries"], 1)
+        self.assertEqual(metrics["failures"], 0)
+
+    def test_refunds_rejected_attempts(self):
+        # A 429 gives its reservation back: after the rejected request the bucket holds at least
+        # as many tokens as after the accepted one (refill only adds more)
+        with StubLLMServer(tokens_per_minute=150, window_seconds=5.0) as server:
+            bucket = TokenBucket(tokens_per_minute=600)
+            client = LLMClient(server.url, "stub", bucket, max_retries=0)
+            self.assertEqual(client.chat(_payload(100, 50)).status_code, 200)
+            after_accepted = bucket._tokens
+            self.assertEqual(client.chat(_payload(100, 50)).status_code, 429)
+            after_rejected = bucket._tokens
+        self.assertLess(after_accepted, 600 - 100)
+        self.assertGreaterEqual(after_rejected, after_accepted)
+
+if __name__ == "__main__":
+    unittest.main()
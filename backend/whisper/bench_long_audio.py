@@ -0,0 +1,71 @@
+import os
+import time
+import wave
+import argparse
+import tempfile
+import numpy as np
+from vad import SAMPLE_RATE
+
+def synthesize_clip(path, minutes, seed=0):
+    # Voice-like harmonic bursts (2-8s) separated by short noisy pauses, written as 16 kHz mono WAV
+    rng = np.random.default_rng(seed)
+    total = int(minutes * 60 * SAMPLE_RATE)
+    parts = []
+    length = 0
+    while length < total:
+        n = int(SAMPLE_RATE * rng.uniform(2, 8))
+        t = np.arange(n) / SAMPLE_RATE
+        pitch = rng.uniform(110, 220)
+        envelope = 0.5 * (1 + np.sin(2 * np.pi * rng.uniform(2, 5) * t))
+        burst = sum(np.sin(2 * np.pi * pitch * h * t) / h for h in range(1, 6)) * envelope * 0.2
+        pause = 0.002 * rng.standard_normal(int(SAMPLE_RATE * rng.uniform(0.4, 1.5)))
+        parts.extend([burst, pause])
+        length += len(burst) + len(pause)
+    audio = np.concatenate(parts)[:total]
+
+    with wave.open(path, "wb") as out:
+        out.setnchannels(1)
+        out.setsampwidth(2)
+        out.setframerate(SAMPLE_RATE)
+        out.writeframes((np.clip(audio, -1, 1) * 32767).astype(np.int16).tobytes())
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare single-shot and chunked parallel transcription.")
+    parser.add_argument("--minutes", type=float, default=20.0, help="Length of the synthetic clip")
+    parser.add_argument("--workers", type=int, default=None, help="Processes for the chunked path (default: one per core)")
+    parser.add_argument("--audio", help="Use this file instead of a synthetic clip")
+    args = parser.parse_args()
+
+    # Imported here so the clip can be generated without loading whisper
+    from transcribe import get_model, transcribe, transcribe_long
+
+    audio_path = args.audio
+    if audio_path is None:
+        audio_path = os.path.join(tempfile.mkdtemp(), "long_clip.wav")
+        synthesize_clip(audio_path, args.minutes)
+        print(f"Synthetic clip: {args.minutes:.1f} min at {audio_path}")
+
+    # Load the model up front so the single-shot timing measures decoding only,
+    # the chunked path pays for model load in its pool workers
+    get_model()
+
+    start = time.perf_counter()
+    single_text = transcribe(audio_path)
+    single_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    first_partial = None
+    chunks = 0
+    parts = []
+    for part in transcribe_long(audio_path, workers=args.workers):
+        if first_partial is None:
+            first_partial = time.perf_counter() - start
+        chunks += 1
+        parts.append(part["text"])
+    chunked_seconds = time.perf_counter() - start
+
+    print(f"Single-shot:        {single_seconds:8.2f}s  ({len(single_text.split())} words)")
+    print(f"Chunked ({chunks:3d} chunks): {chunked_seconds:8.2f}s  ({len(''.join(parts).split())} words)")
+    if first_partial is not None:
+        print(f"First partial after {first_partial:.2f}s")
+    print(f"Speed-up: {single_seconds / chunked_seconds:.2f}x")
@@ -1,29 +1,249 @@
 import whisper
+import torch
+import os
 import sys
+import json
+import time
+import queue
+import argparse
+import threading
 import warnings
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from vad import split_on_silence, stitch
+# instrumentation.py lives in backend/, one level up; appended so it never shadows an installed package
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from instrumentation import request, span, count
 sys.stdout.reconfigure(encoding='utf-8')  # Force UTF-8 output
 
 # Suppress specific warnings
 warnings.filterwarnings("ignore", category=UserWarning, module="whisper")
 
-# Load the Whisper model
-model = whisper.load_model("base")
+MODEL_NAME = "base"
+_model = None
+
+def get_model():
+    # Load the Whisper model once and reuse it for every clip
+    global _model
+    if _model is None:
+        with span("transcribe.model_load", model=MODEL_NAME):
+            _model = whisper.load_model(MODEL_NAME)
+    return _model
 
 def transcribe(audio_path,language='en'):
     try:
         # Transcribe the audio file
-        result = model.transcribe(audio_path,language=language)
+        model = get_model()
+        with span("transcribe.decode", language=language):
+            result = model.transcribe(audio_path,language=language)
         # Log transcription to terminal
         return result['text']
     except Exception as e:
         return str(e)
 
+def transcribe_batch(audio_paths, language='en'):
+    # Returns a list of (text, error) pairs in the same order as audio_paths.
+    # Clips that fit in one 30s window are decoded together in a single batched pass,
+    # longer clips fall back to the regular sliding-window transcribe.
+    model = get_model()
+    results = [None] * len(audio_paths)
+    batch_indices = []
+    mels = []
+    count("transcribe.clips", len(audio_paths))
+
+    for i, audio_path in enumerate(audio_paths):
+        try:
+            with span("transcribe.load_audio"):
+                audio = whisper.load_audio(audio_path)
+            if audio.shape[0] > whisper.audio.N_SAMPLES:
+                count("transcribe.long_clips")
+                with span("transcribe.decode", language=language):
+                    result = model.transcribe(audio, language=language)
+                results[i] = (result['text'], None)
+                continue
+            audio = whisper.pad_or_trim(audio)
+            mels.append(whisper.log_mel_spectrogram(audio, model.dims.n_mels).to(model.device))
+            batch_indices.append(i)
+        except Exception as e:
+            results[i] = (None, str(e))
+
+    if mels:
+        options = whisper.DecodingOptions(language=language, fp16=model.device.type != "cpu")
+        try:
+            with span("transcribe.batch_decode", clips=len(mels), language=language):
+                decoded = whisper.decode(model, torch.stack(mels), options)
+            for i, result in zip(batch_indices, decoded):
+                results[i] = (result.text, None)
+        except Exception as e:
+            for i in batch_indices:
+                results[i] = (None, str(e))
+
+    return results
+
+def _init_chunk_worker(threads):
+    # Each pool process loads its own model once and shares the cores with its siblings
+    torch.set_num_threads(threads)
+    get_model()
+
+def _transcribe_chunk(audio, language):
+    return get_model().transcribe(audio, language=language, condition_on_previous_text=False)['text']
+
+def transcribe_long(audio_path, language='en', workers=None, max_chunk_seconds=30.0):
+    # Splits long audio at silence and decodes the chunks across a process pool.
+    # Yields {"index", "start", "end", "text"} in audio order as soon as each chunk (and every
+    # chunk before it) is done; joining the "text" values gives the stitched transcript.
+    with span("transcribe.split"):
+        audio = whisper.load_audio(audio_path)
+        sample_rate = whisper.audio.SAMPLE_RATE
+        chunks = split_on_silence(audio, sample_rate, max_chunk_seconds)
+    count("transcribe.chunks", len(chunks))
+    if not chunks:
+        return
+
+    cpu_count = os.cpu_count() or 1
+    if workers is None:
+        workers = min(len(chunks), cpu_count)
+
+    # Seconds each chunk shares with the one before it: about a second after a hard cut, where
+    # stitch drops the words heard twice, and 0 after a cut at silence, where repeats are kept
+    overlaps = [0.0] + [max(previous_end - start, 0) / sample_rate
+                        for (_, previous_end), (start, _) in zip(chunks, chunks[1:])]
+
+    transcript = ""
+    if workers <= 1:
+        for index, (start, end) in enumerate(chunks):
+            piece = stitch(transcript, _transcribe_chunk(audio[start:end], language), overlaps[index])
+            transcript += piece
+            yield {"index": index, "start": start / sample_rate, "end": end / sample_rate, "text": piece}
+        return
+
+    # spawn, not fork: forking a process that already initialised torch threads can deadlock
+    context = multiprocessing.get_context("spawn")
+    threads = max(cpu_count // workers, 1)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=_init_chunk_worker, initargs=(threads,)) as pool:
+        futures = [pool.submit(_transcribe_chunk, audio[start:end], language) for start, end in chunks]
+        # Waiting on futures in submission order keeps the output ordered; chunks that
+        # finish early simply wait in their future until it is their turn
+        for index, (future, (start, end)) in enumerate(zip(futures, chunks)):
+            piece = stitch(transcript, future.result(), overlaps[index])
+            transcript += piece
+            yield {"index": index, "start": start / sample_rate, "end": end / sample_rate, "text": piece}
+
+def _run_batch(batch, reply):
+    # Decodes one collected batch of worker jobs and replies to each of them.
+    # Drop jobs that already waited past their deadline.
+    now = time.monotonic()
+    live_jobs = []
+    for job in batch:
+        if now > job["deadline"]:
+            reply({"id": job.get("id"), "error": "Transcription timed out in queue"})
+        else:
+            live_jobs.append(job)
+
+    # A batch can only be decoded with one language at a time
+    by_language = {}
+    for job in live_jobs:
+        by_language.setdefault(job.get("language") or "en", []).append(job)
+
+    for language, language_jobs in by_language.items():
+        # Lets the server time the decode separately from the wait in the queue
+        for job in language_jobs:
+            reply({"id": job.get("id"), "started": True})
+        results = transcribe_batch([job.get("audio", "") for job in language_jobs], language)
+        for job, (text, error) in zip(language_jobs, results):
+            if error is not None:
+                reply({"id": job.get("id"), "error": error})
+            else:
+                reply({"id": job.get("id"), "text": text})
+
+def run_worker(max_batch=8, batch_window=0.05, queue_size=32, job_timeout=120.0):
+    # JSON-lines protocol over stdin/stdout:
+    #   request:  {"id": 1, "audio": "uploads/123.webm", "language": "en", "timeout": 60}
+    #   response: {"id": 1, "started": true} when its decode begins,
+    #             then {"id": 1, "text": "..."} or {"id": 1, "error": "..."}
+    jobs = queue.Queue(maxsize=queue_size)
+    write_lock = threading.Lock()
+
+    def reply(message):
+        with write_lock:
+            sys.stdout.write(json.dumps(message) + "\n")
+            sys.stdout.flush()
+
+    def read_jobs():
+        for line in sys.stdin:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                job = json.loads(line)
+                job["deadline"] = time.monotonic() + float(job.get("timeout") or job_timeout)
+            except (ValueError, TypeError, AttributeError) as e:
+                reply({"id": None, "error": f"Invalid job: {e}"})
+                continue
+            # Blocks while the queue is full, so we stop reading stdin until the decoder catches up
+            jobs.put(job)
+        jobs.put(None)
+
+    threading.Thread(target=read_jobs, daemon=True).start()
+
+    # One trace for start-up, then one per decoded batch
+    with request("transcribe.worker_start"):
+        get_model()
+    reply({"ready": True, "model": MODEL_NAME})
+
+    running = True
+    while running:
+        job = jobs.get()
+        if job is None:
+            break
+
+        # Collect whatever else arrives within the batch window
+        batch = [job]
+        window_end = time.monotonic() + batch_window
+        while len(batch) < max_batch:
+            try:
+                next_job = jobs.get(timeout=max(window_end - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if next_job is None:
+                running = False
+                break
+            batch.append(next_job)
+
+        with request("transcribe.batch", jobs=len(batch)):
+            _run_batch(batch, reply)
+
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
+    parser = argparse.ArgumentParser(description="Transcribe audio with Whisper.")
+    parser.add_argument("audio", nargs="?", help="Audio file to transcribe")
+    parser.add_argument("--long", action="store_true", help="Chunk long audio at silence and transcribe the chunks in parallel")
+    parser.add_argument("--workers", type=int, default=None, help="Processes used by --long (default: one per core)")
+    parser.add_argument("--worker", action="store_true", help="Run as a long-lived JSON-lines worker on stdin/stdout")
+    parser.add_argument("--batch-size", type=int, default=8, help="Maximum clips decoded together in worker mode")
+    parser.add_argument("--batch-window", type=float, default=0.05, help="Seconds to wait for more clips before decoding a batch")
+    parser.add_argument("--queue-size", type=int, default=32, help="Maximum queued jobs before the worker stops reading stdin")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Default per-job timeout in seconds")
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.batch_size, args.batch_window, args.queue_size, args.timeout)
+        sys.exit(0)
+
+    if not args.audio:
         print("Please provide the audio file path.")
         sys.exit(1)
 
-    audio_file = sys.argv[1]
-    transcription = transcribe(audio_file)
+    audio_file = args.audio
+    if args.long:
+        # Stream partial transcripts as they are ready; the concatenated output is the full text
+        with request("transcribe", mode="long"):
+            for part in transcribe_long(audio_file, workers=args.workers):
+                print(part["text"], end="", flush=True)
+        print()
+        sys.exit(0)
+
+    with request("transcribe", mode="single"):
+        transcription = transcribe(audio_file)
     # Only print the final transcription to the console
     print(transcription)  # This will be captured by Node.js
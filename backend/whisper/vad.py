@@ -0,0 +1,97 @@
+import re
+import math
+import numpy as np
+
+SAMPLE_RATE = 16000
+MAX_WORDS_PER_SECOND = 4  # Fast conversational speech, bounds the words an overlap can repeat
+
+def frame_energy(audio, frame_length):
+    # RMS energy of consecutive non-overlapping frames
+    n_frames = len(audio) // frame_length
+    if n_frames == 0:
+        return np.zeros(0, dtype=np.float32)
+    frames = audio[:n_frames * frame_length].reshape(n_frames, frame_length)
+    return np.sqrt(np.mean(np.square(frames, dtype=np.float32), axis=1))
+
+def split_on_silence(audio, sample_rate=SAMPLE_RATE, max_chunk_seconds=30.0,
+                     min_silence_seconds=0.3, frame_seconds=0.03, threshold_ratio=0.1,
+                     hard_cut_overlap_seconds=1.0):
+    # Returns (start, end) sample offsets covering the speech in audio. Chunks are cut in the
+    # middle of silent stretches and never exceed max_chunk_seconds. If no silence is found the
+    # chunk is hard cut, and the next one starts hard_cut_overlap_seconds earlier so a word split
+    # by the cut is heard whole in one of them; stitch removes the words both chunks transcribe.
+    total = len(audio)
+    frame_length = max(int(sample_rate * frame_seconds), 1)
+    max_length = int(sample_rate * max_chunk_seconds)
+    hard_cut_overlap = min(int(sample_rate * hard_cut_overlap_seconds), max_length // 2)
+    energy = frame_energy(audio, frame_length)
+    if len(energy) == 0:
+        return [(0, total)] if total else []
+
+    # Adaptive threshold between the noise floor and the typical loud level
+    floor = np.percentile(energy, 10)
+    peak = np.percentile(energy, 90)
+    threshold = floor + threshold_ratio * (peak - floor)
+    silent = energy <= threshold
+
+    # Silent runs long enough to cut in, as candidate cut points in samples
+    edges = np.diff(np.concatenate(([0], silent.astype(np.int8), [0])))
+    run_starts = np.flatnonzero(edges == 1)
+    run_ends = np.flatnonzero(edges == -1)
+    min_silence_frames = max(int(min_silence_seconds / frame_seconds), 1)
+    cuts = [((s + e) // 2) * frame_length for s, e in zip(run_starts, run_ends) if e - s >= min_silence_frames]
+
+    chunks = []
+    start = 0
+    i = 0
+    while total - start > max_length:
+        limit = start + max_length
+        best = None
+        while i < len(cuts) and cuts[i] <= limit:
+            if cuts[i] > start:
+                best = cuts[i]
+            i += 1
+        if best is not None:
+            chunks.append((start, best))
+            start = best
+        else:
+            chunks.append((start, limit))
+            start = limit - hard_cut_overlap
+    chunks.append((start, total))
+
+    # Skip chunks with no speech at all, whisper tends to hallucinate on pure silence
+    speech_chunks = []
+    for start, end in chunks:
+        chunk_energy = energy[start // frame_length:max(end // frame_length, start // frame_length + 1)]
+        if len(chunk_energy) and chunk_energy.max() > threshold:
+            speech_chunks.append((start, end))
+    return speech_chunks
+
+def _words(text):
+    return [re.sub(r"[^\w']", "", word).lower() for word in text.split()]
+
+def stitch(transcript, text, overlap_seconds=0.0, max_overlap_words=5, min_overlap_words=2):
+    # Returns the piece to append to transcript, whitespace normalised. Only when the chunk
+    # overlapped the previous one in time by overlap_seconds is a phrase repeated across the
+    # boundary removed from the start of text, and only as many words as could be spoken in that
+    # window. Only hard cuts overlap; chunks cut at silence don't, so a speaker repeating
+    # themselves ("no, no") there keeps every word. Single repeated words are always kept, they are far more often genuine
+    # ("that that") than decoding artifacts.
+    text = " ".join(text.split())
+    if not text:
+        return ""
+    if not transcript:
+        return text
+
+    head_words = text.split(" ")
+    window = min(max_overlap_words, math.ceil(overlap_seconds * MAX_WORDS_PER_SECOND)) if overlap_seconds > 0 else 0
+    if window >= min_overlap_words:
+        tail = _words(transcript)[-window:]
+        head = _words(text)[:window]
+        for size in range(min(len(tail), len(head)), min_overlap_words - 1, -1):
+            if tail[-size:] == head[:size]:
+                head_words = head_words[size:]
+                break
+    if not head_words:
+        return ""
+    return " " + " ".join(head_words)